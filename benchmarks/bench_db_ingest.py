@@ -0,0 +1,40 @@
+'''
+Compares the per-position INSERT path of db.Variants.insertVariant with the bulk-ingest
+mode that freebayes_patch.py uses, on a synthetic debug stream.
+
+usage: python benchmarks/bench_db_ingest.py [-n N_POSITIONS] [-d DEPTH] [-B BATCH_SIZE]
+'''
+
+import os
+import time
+import tempfile
+import argparse
+
+import synthetic
+import db
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--n_positions", type = int, default = 20000)
+parser.add_argument("-d", "--depth", type = int, default = 30)
+parser.add_argument("-B", "--batch_size", type = int, default = 1000)
+args = parser.parse_args()
+
+positions = list(synthetic.position_lists(args.n_positions, depth = args.depth))
+n_rows = sum(len(p[2]) for p in positions)
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+	for bulk in (False, True):
+		dbpath = os.path.join(tmp_dir, 'bulk.db' if bulk else 'per_position.db')
+		start_time = time.time()
+		vardb = db.Variants(dbpath = dbpath, bulk = bulk, batch_size = args.batch_size)
+		for chrom, position, position_list in positions:
+			vardb.insertVariant(chrom, position, position_list)
+		if bulk:
+			vardb.finishBulkInsert()
+		vardb.con.close()
+		elapsed = time.time() - start_time
+		print('bulk' if bulk else 'per-position',
+			'{:.2f}s'.format(elapsed),
+			'{:.0f} positions/s'.format(len(positions) / elapsed),
+			'{:.0f} rows/s'.format(n_rows / elapsed),
+			sep = '\t')
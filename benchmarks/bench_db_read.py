@@ -0,0 +1,58 @@
+'''
+Throughput of getPositionVariants with parallel readers, like hoobari's region jobs, for a
+database opened read-write (as hoobari did before) and read-only (read_only=True).
+
+usage: python benchmarks/bench_db_read.py [-n N_POSITIONS] [-d DEPTH] [-@ MAX_WORKERS] [--repeats R]
+'''
+
+import os
+import time
+import tempfile
+import argparse
+from multiprocessing import Pool
+
+import synthetic
+import db
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--n_positions", type = int, default = 20000)
+parser.add_argument("-d", "--depth", type = int, default = 30)
+parser.add_argument("-@", "--max_workers", type = int, default = os.cpu_count())
+parser.add_argument("--repeats", type = int, default = 3, help = 'number of passes of each worker over its positions')
+args = parser.parse_args()
+
+def query_positions(job):
+	dbpath, read_only, positions, repeats = job
+	vardb = db.Variants(dbpath, probe = False, read_only = read_only)
+	n_rows = 0
+	for i in range(repeats):
+		for chrom, position in positions:
+			n_rows += len(vardb.getPositionVariants(chrom, position, 'lengths').fetchall())
+	vardb.con.close()
+	return n_rows
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+	dbpath = os.path.join(tmp_dir, 'hoobari.db')
+	vardb = db.Variants(dbpath, bulk = True)
+	positions = []
+	for chrom, position, position_list in synthetic.position_lists(args.n_positions, depth = args.depth):
+		vardb.insertVariant(chrom, position, position_list)
+		positions.append((chrom, position))
+	vardb.finishBulkInsert()
+	vardb.con.close()
+
+	n_workers = 1
+	while n_workers <= args.max_workers:
+		for read_only in (False, True):
+			# each worker queries every n_workers-th position, like region jobs splitting a genome
+			jobs = [(dbpath, read_only, positions[i::n_workers], args.repeats) for i in range(n_workers)]
+			with Pool(n_workers) as pool:
+				start_time = time.time()
+				pool.map(query_positions, jobs)
+				elapsed = time.time() - start_time
+			print(	'read-only' if read_only else 'read-write',
+				str(n_workers) + ' workers',
+				'{:.2f}s'.format(elapsed),
+				'{:.0f} queries/s'.format(len(positions) * args.repeats / elapsed),
+				sep = '\t')
+		n_workers *= 2
@@ -0,0 +1,86 @@
+'''
+Throughput (MB/s) of debug_stream.DebugStreamParser against the line-by-line text loop that
+freebayes_patch.py used before, on a synthetic freebayes -d debug stream.
+
+usage: python benchmarks/bench_debug_stream.py [-n N_POSITIONS] [-d DEPTH] [--noise_lines N]
+'''
+
+import io
+import os
+import time
+import tempfile
+import argparse
+
+import synthetic
+from debug_stream import DebugStreamParser
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--n_positions", type = int, default = 20000)
+parser.add_argument("-d", "--depth", type = int, default = 30)
+parser.add_argument("--noise_lines", type = int, default = 100, help = 'discarded debug lines per position')
+args = parser.parse_args()
+
+def line_loop(stream, out):
+	'''
+	the main loop of freebayes_patch.py before DebugStreamParser, without the db and bam work
+	'''
+	records = []
+	for line in stream:
+		if line.startswith('#'):
+			print(line, end = '', file = out)
+		elif line.startswith('position: '):
+			initiate_var = True
+			line = line.split()
+			var = line[1]
+		elif line.startswith('haplo_obs'):
+			if initiate_var:
+				chrom, position = var.split(':')
+				position_list = []
+				initiate_var = False
+			line = line.rstrip().split('\t')
+			geno = line[3]
+			read = line[4].split(':')
+			qname = ':'.join(read[1:-10])
+			strand = 1 if read[-6] == '+' else 0
+			position_list.append([geno, qname, strand])
+		elif 'TYPE=' in line:
+			line_list = line.rstrip().split('\t')
+			if not initiate_var:
+				records.append((chrom, position, position_list, line_list))
+			print(line, end = '', file = out)
+	return records
+
+def parser_loop(stream, out):
+	records = []
+	for batch in DebugStreamParser(stream, out = out).batches():
+		records += batch
+	return records
+
+def as_position_lists(records):
+	return [(record.chrom, record.position, [list(obs) for obs in zip(record.genotypes, record.qnames, record.strands)], record.vcf_fields)
+		for record in records]
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+	stream_path = os.path.join(tmp_dir, 'debug.txt')
+	with open(stream_path, 'w') as f:
+		f.writelines(synthetic.debug_stream(args.n_positions, depth = args.depth, noise_lines = args.noise_lines))
+	size_mb = os.path.getsize(stream_path) / 2**20
+
+	start_time = time.time()
+	with open(stream_path) as stream:
+		text_out = io.StringIO()
+		expected = line_loop(stream, text_out)
+	line_loop_time = time.time() - start_time
+
+	start_time = time.time()
+	with open(stream_path, 'rb') as stream:
+		binary_out = io.BytesIO()
+		records = parser_loop(stream, binary_out)
+	parser_time = time.time() - start_time
+
+	assert as_position_lists(records) == expected, 'the parser and the line loop disagree'
+	assert binary_out.getvalue().decode() == text_out.getvalue(), 'different passthrough output'
+
+	print('stream size: {:.1f} MB, {} positions'.format(size_mb, len(records)))
+	print('line loop', '{:.2f}s'.format(line_loop_time), '{:.1f} MB/s'.format(size_mb / line_loop_time), sep = '\t')
+	print('parser', '{:.2f}s'.format(parser_time), '{:.1f} MB/s'.format(size_mb / parser_time), sep = '\t')
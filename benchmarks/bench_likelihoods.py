@@ -0,0 +1,76 @@
+'''
+Time per site of position.calculate_likelihoods, against the loop over the fragments of a site
+with calculate_fragment_i that it replaced, for sites of different depths. The log-likelihoods
+of both are checked to be identical.
+
+usage: python benchmarks/bench_likelihoods.py [-d DEPTH [DEPTH ...]] [-n N_SITES] [-model MODEL]
+'''
+
+import sys
+import time
+import random
+import argparse
+
+import synthetic
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-d", "--depths", type = int, nargs = '+', default = [10, 30, 100, 1000, 10000])
+parser.add_argument("-n", "--n_sites", type = int, default = 200)
+parser.add_argument("-model", "--model", default = 'lengths')
+args = parser.parse_args()
+
+# position's imports parse hoobari's arguments
+sys.argv = sys.argv[:1]
+import numpy as np
+import pandas as pd
+import position
+import preprocessing
+
+class Record(object):
+	def __init__(self, position):
+		self.CHROM, self.POS, self.REF, self.ALT = 'chr1', position, 'A', ['C']
+
+def loop_likelihoods(pos_data, maternal_gt, ref, alt, total_fetal_fraction, fetal_fractions_df, err_rate, model):
+	'''
+	the per-fragment loop calculate_likelihoods had, for a snp
+	'''
+	sum_log_fragments_likelihoods = None
+	for frag_genotype, frag_length, frag_is_fetal in pos_data:
+		if (model == 'origin') and (frag_is_fetal == 1):
+			p_fetal = 1 - err_rate
+		elif (model in ('lengths', 'origin')) and (frag_length in fetal_fractions_df.index.values):
+			p_fetal = fetal_fractions_df[frag_length]
+		else:
+			p_fetal = total_fetal_fraction
+		frag_i_likelihoods = np.log(position.calculate_fragment_i(frag_genotype, maternal_gt, ref, alt, p_fetal, err_rate), dtype = np.float64)
+		if sum_log_fragments_likelihoods is None:
+			sum_log_fragments_likelihoods = frag_i_likelihoods
+		else:
+			sum_log_fragments_likelihoods = np.add(sum_log_fragments_likelihoods, frag_i_likelihoods)
+	return sum_log_fragments_likelihoods
+
+rng = random.Random(0)
+total_fetal_fraction, err_rate = 0.1, 0.0
+fetal_fractions_df = pd.Series(np.random.default_rng(0).uniform(0.05, 0.2, 500))
+fetal_fractions = preprocessing.fetal_fractions_lookup(fetal_fractions_df, total_fetal_fraction)
+
+for depth in args.depths:
+	n_sites = max(1, min(args.n_sites, 200000 // depth))
+	sites = [[(rng.choice('AC'), rng.randint(100, 600), rng.randint(0, 1)) for i in range(depth)] for s in range(n_sites)]
+
+	start_time = time.time()
+	loop_results = [loop_likelihoods(pos_data, 1, 'A', 'C', total_fetal_fraction, fetal_fractions_df, err_rate, args.model) for pos_data in sites]
+	loop_time = (time.time() - start_time) / n_sites
+
+	start_time = time.time()
+	results = [position.calculate_likelihoods(	Record(i + 1), 1, total_fetal_fraction, fetal_fractions, err_rate,
+							None, args.model, None, pos_data = pos_data)
+			for i, pos_data in enumerate(sites)]
+	kernel_time = (time.time() - start_time) / n_sites
+
+	assert all(np.array_equal(a, b) for a, b in zip(loop_results, results))
+	print(	'depth ' + str(depth),
+		'loop {:.1f}us/site'.format(loop_time * 1e6),
+		'vectorized {:.1f}us/site'.format(kernel_time * 1e6),
+		'{:.1f}x'.format(loop_time / kernel_time),
+		sep = '\t')
@@ -0,0 +1,108 @@
+'''
+Speed (sites/s) of pileup_ingest.py, and its concordance with the freebayes path
+(freebayes_patch.py), on a shared fixture.
+
+By default the fixture is synthetic (synthetic.write_pileup_fixture), and the freebayes path is
+run on its debug stream. To validate on real data, pass the inputs of a region together with a
+database that freebayes_patch.py built for it:
+
+usage: python benchmarks/bench_pileup_ingest.py [-n N_SITES] [-d DEPTH] [--spacing BP]
+       python benchmarks/bench_pileup_ingest.py -b CFDNA_BAM -parents_vcf VCF -m M_BAM -p P_BAM -r REGION --reference_db REGION.db
+'''
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import argparse
+import subprocess
+from collections import Counter
+
+import pysam
+import vcf
+import synthetic
+import db
+from ingest import get_parental_samples_names, finish_databases
+from pileup_ingest import parental_sites, ingest_sites
+
+patch_path = os.path.join(synthetic.src_dir, 'freebayes_patch.py')
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--n_sites", type = int, default = 20000)
+parser.add_argument("-d", "--depth", type = int, default = 30)
+parser.add_argument("--spacing", type = int, default = 50)
+parser.add_argument("-b", "--bam_file", help = 'cfDNA bam, instead of the synthetic fixture')
+parser.add_argument("-parents_vcf", "--parents_vcf")
+parser.add_argument("-m", "--m_bam")
+parser.add_argument("-p", "--p_bam")
+parser.add_argument("-r", "--region", default = None)
+parser.add_argument("--reference_db", help = 'database of the same inputs, built by freebayes_patch.py')
+args = parser.parse_args()
+
+def variant_rows(dbpath):
+	'''
+	the rows of the variants table, grouped by (chromosome, position)
+	'''
+	con = sqlite3.connect(dbpath)
+	sites = {}
+	for row in con.execute('SELECT chromosome, pos, fragment_id, genotype, strand, length, for_ff, is_fetal FROM variants'):
+		sites.setdefault(row[:2], Counter())[row[2:]] += 1
+	con.close()
+	return sites
+
+def length_counts(dbpath, table):
+	con = sqlite3.connect(dbpath)
+	counts = dict(con.execute('SELECT * FROM ' + table).fetchall())
+	con.close()
+	return counts
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+	if args.bam_file:
+		bam_file, parents_vcf, m_bam, p_bam = args.bam_file, args.parents_vcf, args.m_bam, args.p_bam
+		reference_db = args.reference_db
+	else:
+		fixture = synthetic.write_pileup_fixture(	os.path.join(tmp_dir, 'fixture'),
+								n_sites = args.n_sites,
+								depth = args.depth,
+								spacing = args.spacing)
+		bam_file, parents_vcf = os.path.join(fixture, 'cf.bam'), os.path.join(fixture, 'parents.vcf.gz')
+		m_bam, p_bam = os.path.join(fixture, 'M01.bam'), os.path.join(fixture, 'F01.bam')
+
+		# the freebayes path, with the fixture's debug stream in place of freebayes' output
+		start_time = time.time()
+		with open(os.path.join(fixture, 'debug.txt')) as debug_stream:
+			subprocess.run(	[sys.executable, patch_path, '-b', bam_file, '-parents_vcf', parents_vcf, '-m', m_bam, '-p', p_bam,
+					'-t', os.path.join(tmp_dir, 'freebayes_path')],
+					stdin = debug_stream, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, check = True)
+		print('freebayes_patch.py (without freebayes)', '{:.2f}s'.format(time.time() - start_time), sep = '\t')
+		reference_db = os.path.join(tmp_dir, 'freebayes_path', 'hoobari.db')
+
+	dbpath = os.path.join(tmp_dir, 'pileup.db')
+	start_time = time.time()
+	bam_reader = pysam.AlignmentFile(bam_file, 'rb')
+	parents_sample_names = get_parental_samples_names(m_bam, p_bam)
+	vardb = db.open_db(dbpath, bulk = True)
+	vardb.create_samples_table(parents_sample_names)
+	with open(os.devnull, 'w') as devnull:
+		n_sites, n_inserted = ingest_sites(	bam_reader,
+							parental_sites(vcf.Reader(filename = parents_vcf), parents_sample_names, args.region),
+							[vardb],
+							out = devnull)
+	finish_databases([vardb])
+	elapsed = time.time() - start_time
+	print(	'pileup_ingest.py', '{:.2f}s'.format(elapsed),
+		'{:.0f} sites/s'.format(n_sites / elapsed),
+		'{} of {} sites covered'.format(n_inserted, n_sites),
+		sep = '\t')
+
+	if reference_db:
+		reference_sites, pileup_sites = variant_rows(reference_db), variant_rows(dbpath)
+		shared_sites = reference_sites.keys() & pileup_sites.keys()
+		n_reference_rows = sum(sum(reference_sites[site].values()) for site in shared_sites)
+		n_shared_rows = sum(sum((reference_sites[site] & pileup_sites[site]).values()) for site in shared_sites)
+		print('sites', 'both: ' + str(len(shared_sites)), 'freebayes path only: ' + str(len(reference_sites.keys() - shared_sites)),
+			'pileup only: ' + str(len(pileup_sites.keys() - shared_sites)), sep = '\t')
+		print('rows of shared sites', 'identical: {:.4%}'.format(n_shared_rows / max(n_reference_rows, 1)), sep = '\t')
+		for table in ('fetal_length_counts', 'shared_length_counts'):
+			print(table, 'identical' if length_counts(reference_db, table) == length_counts(dbpath, table) else 'different', sep = '\t')
@@ -0,0 +1,85 @@
+'''
+Latency of the posteriors and QUAL (position.calculate_posteriors and call_genotypes) at sites of
+extreme depth, where the joint probabilities of the genotypes are thousands of log units apart
+and their exponents overflow. The QUALs are compared to a calculation with python's decimal
+module, to output precision (2 decimals).
+
+usage: python benchmarks/bench_posteriors.py [-d DEPTH [DEPTH ...]] [-n N_SITES]
+'''
+
+import sys
+import time
+import random
+import argparse
+from decimal import Decimal, Context
+
+import synthetic
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-d", "--depths", type = int, nargs = '+', default = [100, 1000, 10000, 100000])
+parser.add_argument("-n", "--n_sites", type = int, default = 20)
+args = parser.parse_args()
+
+# position's imports parse hoobari's arguments
+sys.argv = sys.argv[:1]
+import numpy as np
+import position
+
+class Record(object):
+	def __init__(self, position):
+		self.CHROM, self.POS, self.REF, self.ALT = 'chr1', position, 'A', ['C']
+
+decimal_context = Context(prec = 50, Emin = -10**9)
+
+def decimal_qual(priors, likelihoods):
+	'''
+	QUAL, calculated with decimals, from the priors and log-likelihoods of a site
+	'''
+	joint_probabilities = [decimal_context.add(Decimal(float(np.log(prior))), Decimal(float(likelihood)))
+				for prior, likelihood in zip(priors, likelihoods) if prior > 0]
+	if priors[0] == 0:
+		return np.inf
+	exps = [decimal_context.exp(j) for j in joint_probabilities]
+	posterior = decimal_context.divide(exps[0], sum(exps[1:], exps[0]))
+	return float(-10 * decimal_context.log10(posterior))
+
+rng = random.Random(0)
+total_fetal_fraction, err_rate = 0.1, 0.003
+fetal_fractions = np.full(1, total_fetal_fraction)
+
+for depth in args.depths:
+	sites = []
+	for s in range(args.n_sites):
+		maternal_gt, paternal_gt = rng.choice([(0, 1), (0, 2), (1, 1), (1, 0), (2, 1)])
+		# alt fragments in the proportion of a fetal 0/1 or 1/1
+		fetal_gt = rng.choice([0, 1, 2])
+		p_alt = maternal_gt / 2 * (1 - total_fetal_fraction) + fetal_gt / 2 * total_fetal_fraction
+		pos_data = [('C' if rng.random() < p_alt else 'A', rng.randint(100, 600), 0) for i in range(depth)]
+		priors = position.calculate_priors(maternal_gt, paternal_gt)
+		likelihoods = position.calculate_likelihoods(	Record(s + 1), maternal_gt, total_fetal_fraction, fetal_fractions, err_rate,
+								None, 'simple', None, pos_data = pos_data)
+		sites.append((priors, likelihoods))
+
+	site_times = []
+	quals = []
+	for priors, likelihoods in sites:
+		start_time = time.time()
+		posteriors, prediction, qual = position.calculate_posteriors(priors, likelihoods)
+		site_times.append(time.time() - start_time)
+		quals.append(qual)
+
+	start_time = time.time()
+	predictions, block_quals, normalized_likelihoods, block_priors, block_posteriors = position.call_genotypes(*zip(*sites))
+	block_time = (time.time() - start_time) / len(sites)
+
+	# QUALs are written with 2 decimals
+	reference_quals = [decimal_qual(priors, likelihoods) for priors, likelihoods in sites]
+	n_same = sum(qual == reference_qual or abs(qual - reference_qual) < 0.005 for qual, reference_qual in zip(block_quals, reference_quals))
+	assert [str(qual) for qual in quals] == [str(position.format_qual(qual)) for qual in block_quals]
+	spread = max(np.ptp(likelihoods) for priors, likelihoods in sites)
+	print(	'depth ' + str(depth),
+		'likelihoods spread up to {:.0f}'.format(spread),
+		'calculate_posteriors max {:.1f}us/site'.format(max(site_times) * 1e6),
+		'call_genotypes {:.1f}us/site'.format(block_time * 1e6),
+		'QUAL as with decimals: {} of {} sites'.format(n_same, len(sites)),
+		sep = '\t')
@@ -0,0 +1,49 @@
+'''
+Per-position queries (getPositionVariants) against the ordered region scans of
+db.RegionVariants, as hoobari reads the rows of consecutive positions, for both backends.
+RegionVariants scans regions of the columnar store only; on sqlite it queries each position,
+as a scan ordered by position wasn't faster there.
+
+usage: python benchmarks/bench_region_variants.py [-n N_POSITIONS] [-d DEPTH] [-model MODEL]
+'''
+
+import os
+import time
+import tempfile
+import argparse
+
+import synthetic
+import db
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--n_positions", type = int, default = 20000)
+parser.add_argument("-d", "--depth", type = int, default = 30)
+parser.add_argument("-model", "--model", default = 'lengths')
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+	for backend in ('sqlite', 'columnar'):
+		dbpath = os.path.join(tmp_dir, backend + '.db')
+		vardb = db.open_db(dbpath, backend = backend, bulk = True)
+		positions = []
+		for chrom, position, position_list in synthetic.position_lists(args.n_positions, depth = args.depth):
+			vardb.insertVariant(chrom, position, position_list)
+			positions.append((chrom, position))
+		vardb.finishBulkInsert()
+		vardb.createQnamesTable()
+		vardb = db.open_db(dbpath, probe = False, read_only = True)
+
+		start_time = time.time()
+		n_rows = sum(len(vardb.getPositionVariants(chrom, position, args.model).fetchall()) for chrom, position in positions)
+		per_position_time = time.time() - start_time
+
+		start_time = time.time()
+		region_variants = db.RegionVariants(vardb, args.model)
+		n_region_rows = sum(len(region_variants.get(chrom, position)) for chrom, position in positions)
+		region_time = time.time() - start_time
+
+		assert n_rows == n_region_rows
+		for name, elapsed in (('per-position', per_position_time), ('region scan', region_time)):
+			print(	backend, name, '{:.2f}s'.format(elapsed),
+				'{:.0f} positions/s'.format(len(positions) / elapsed),
+				sep = '\t')
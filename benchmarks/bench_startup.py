@@ -0,0 +1,75 @@
+'''
+Startup time of hoobari: of `hoobari_main.py --help`, and the wall time of a region job on a
+small fixture (synthetic.write_pileup_fixture, ingested with pileup_ingest.py), run in a new
+interpreter each time, as the jobs of scripts/hoobari-parallel are. The first region job also
+saves the pre-processing results, that the next ones load (see preprocessing.save_preprocessing).
+
+usage: python benchmarks/bench_startup.py [-n N_SITES] [-R REPEATS]
+'''
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import subprocess
+import statistics
+
+import pysam
+import synthetic
+
+hoobari_path = os.path.join(synthetic.src_dir, 'hoobari_main.py')
+pileup_ingest_path = os.path.join(synthetic.src_dir, 'pileup_ingest.py')
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--n_sites", type = int, default = 200)
+parser.add_argument("-d", "--depth", type = int, default = 30)
+parser.add_argument("-R", "--repeats", type = int, default = 10)
+args = parser.parse_args()
+
+def run_times(command, repeats):
+	'''
+	wall times of repeats runs of command, each in a new process
+	'''
+	times = []
+	for i in range(repeats):
+		start_time = time.time()
+		subprocess.run(command, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, check = True)
+		times.append(time.time() - start_time)
+	return times
+
+def print_times(name, times):
+	print(	name,
+		'median {:.3f}s'.format(statistics.median(times)),
+		'min {:.3f}s'.format(min(times)),
+		sep = '\t')
+
+print_times('python startup', run_times([sys.executable, '-c', 'pass'], args.repeats))
+print_times('hoobari --help', run_times([sys.executable, hoobari_path, '--help'], args.repeats))
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+	fixture = synthetic.write_pileup_fixture(os.path.join(tmp_dir, 'fixture'), n_sites = args.n_sites, depth = args.depth)
+	bam_file, parents_vcf = os.path.join(fixture, 'cf.bam'), os.path.join(fixture, 'parents.vcf.gz')
+	region = 'chr1:0-' + str(pysam.AlignmentFile(bam_file).lengths[0])
+	hb_tmp_dir = os.path.join(tmp_dir, 'tmp_hb')
+
+	cfdna_vcf = os.path.join(tmp_dir, 'cfdna.vcf')
+	with open(cfdna_vcf, 'w') as out:
+		subprocess.run(	[sys.executable, pileup_ingest_path, '-b', bam_file, '-parents_vcf', parents_vcf,
+				'-m', os.path.join(fixture, 'M01.bam'), '-p', os.path.join(fixture, 'F01.bam'),
+				'-t', hb_tmp_dir, '-r', region],
+				stdout = out, stderr = subprocess.DEVNULL, check = True)
+	cfdna_vcf = pysam.tabix_index(cfdna_vcf, preset = 'vcf')
+
+	# the alleles of the fixture's reads are random, so the fetal fraction is given, with the simple model
+	region_job = [	sys.executable, hoobari_path,
+			'-parents_vcf', parents_vcf,
+			'-cfdna_vcf', cfdna_vcf,
+			'-cfdna_bam', bam_file,
+			'-t', hb_tmp_dir,
+			'-r', region,
+			'-%', '0.1',
+			'-model', 'simple',
+			'-o', os.devnull]
+	print_times('region job, pre-processing', run_times(region_job, 1))
+	print_times('region job', run_times(region_job, args.repeats))
@@ -0,0 +1,145 @@
+'''
+Synthetic freebayes -d debug streams and patch output, used by the benchmarks.
+The lines imitate the parts of freebayes' debug output that freebayes_patch.py reads:
+"position: " lines, "haplo_obs" lines, vcf header lines and vcf records (with TYPE= in INFO),
+mixed with debug lines that the patch discards.
+'''
+
+import os
+import sys
+import random
+
+src_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+sys.path.insert(0, os.path.abspath(src_dir))
+
+def qname(read_idx):
+	# Illumina read names contain colons, like the ones the patch has to re-join
+	return 'A00123:45:HKJ2VDSXX:1:' + str(1101 + read_idx % 50) + ':' + str(read_idx) + ':' + str(1000 + read_idx % 997)
+
+def debug_stream(n_positions, depth = 30, chrom = 'chr1', spacing = 5, noise_lines = 20, seed = 0):
+	'''
+	yields the lines (with line endings) of a synthetic debug stream with n_positions
+	positions, each covered by depth reads. neighbouring positions are spacing bp apart
+	and share most of their reads.
+	'''
+	rng = random.Random(seed)
+	yield '##fileformat=VCFv4.2\n'
+	yield '##INFO=<ID=TYPE,Number=A,Type=String,Description="The type of allele">\n'
+	yield '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tcfdna\n'
+	for i in range(n_positions):
+		pos = 10000 + i * spacing
+		for j in range(noise_lines):
+			yield 'haplotype alleles: ' + str(pos + j) + ' ' + 'A:' * 10 + '\n'
+		yield 'position: ' + chrom + ':' + str(pos) + ' coverage: ' + str(depth) + '\n'
+		first_read = i * spacing
+		for r in range(first_read, first_read + depth):
+			geno = rng.choice('AC')
+			strand = '+' if r % 2 else '-'
+			read = ':'.join(['cfdna', qname(r), str(pos), '1', '1X', 'snp', strand, '60', '40', '0', '0', '1'])
+			yield '\t'.join(['haplo_obs', str(pos), '1', geno, read]) + '\n'
+		yield '\t'.join([chrom, str(pos), '.', 'A', 'C', '50', '.', 'AB=0.5;DP=' + str(depth) + ';TYPE=snp', 'GT:DP', '0/1:' + str(depth)]) + '\n'
+
+def position_lists(n_positions, depth = 30, seed = 0):
+	'''
+	yields (chromosome, position, info_list) tuples, in the form that freebayes_patch.py
+	passes to db.Variants.insertVariant, parsed from a synthetic debug stream
+	'''
+	rng = random.Random(seed)
+	position_list = []
+	for line in debug_stream(n_positions, depth = depth, seed = seed):
+		if line.startswith('position: '):
+			chrom, position = line.split()[1].split(':')
+			position_list = []
+		elif line.startswith('haplo_obs'):
+			line = line.rstrip().split('\t')
+			read = line[4].split(':')
+			position_list.append([	line[3],
+						float(rng.randint(100, 500)),
+						':'.join(read[1:-10]),
+						1 if read[-6] == '+' else 0,
+						rng.randint(0, 1),
+						rng.randint(0, 2)])
+		elif 'TYPE=' in line and not line.startswith('#'):
+			yield chrom.replace('chr', ''), int(position), position_list
+
+def write_pileup_fixture(out_dir, n_sites = 2000, depth = 30, spacing = 50, read_length = 100, seed = 0):
+	'''
+	writes a fixture on which both ingest engines can be run: a cfDNA bam (cf.bam) of reads with
+	random A/C bases at snps spaced spacing bp apart, empty parental bams (M01.bam, F01.bam)
+	whose read groups name the parental samples, a parents vcf with the snps (parents.vcf.gz)
+	and debug.txt, the freebayes -d debug stream of the same reads, to be piped into
+	freebayes_patch.py in place of freebayes. returns out_dir.
+	'''
+	import pysam
+
+	rng = random.Random(seed)
+	os.makedirs(out_dir, exist_ok = True)
+	chrom = 'chr1'
+	sites = [10000 + i * spacing for i in range(n_sites)] # 1-based
+	contig_length = sites[-1] + 10000
+	header = lambda sample: {	'HD': {'VN': '1.0', 'SO': 'coordinate'},
+					'SQ': [{'SN': chrom, 'LN': contig_length}],
+					'RG': [{'ID': sample, 'SM': sample}]}
+
+	# reads starting uniformly between the first and last site, depth reads per site on average
+	n_reads = depth * (sites[-1] - sites[0] + read_length) // read_length
+	starts = sorted(rng.randint(sites[0] - read_length, sites[-1] - 1) for r in range(n_reads)) # 0-based
+	site_reads = {position: [] for position in sites}
+	with pysam.AlignmentFile(os.path.join(out_dir, 'cf.bam'), 'wb', header = header('cfdna')) as f:
+		for r, start in enumerate(starts):
+			sequence = ['A'] * read_length
+			is_reverse = r % 2 == 1
+			template_length = rng.randint(100, 500)
+			first_site = sites[0] + max(0, -(-(start + 1 - sites[0]) // spacing)) * spacing
+			for position in range(first_site, start + read_length + 1, spacing):
+				if position in site_reads:
+					sequence[position - 1 - start] = rng.choice('AC')
+					site_reads[position].append((qname(r), sequence[position - 1 - start], is_reverse))
+			a = pysam.AlignedSegment()
+			a.query_name = qname(r)
+			a.query_sequence = ''.join(sequence)
+			a.flag = 1 | 2 | 64 | (16 if is_reverse else 32)
+			a.reference_id = 0
+			a.reference_start = start
+			a.mapping_quality = 60
+			a.cigar = ((0, read_length),)
+			a.next_reference_id = 0
+			a.next_reference_start = start + template_length - read_length
+			a.template_length = template_length
+			a.query_qualities = pysam.qualitystring_to_array('I' * read_length)
+			f.write(a)
+	pysam.index(os.path.join(out_dir, 'cf.bam'))
+	for sample in ('M01', 'F01'):
+		with pysam.AlignmentFile(os.path.join(out_dir, sample + '.bam'), 'wb', header = header(sample)) as f:
+			pass
+
+	genotypes = ['0/0', '0/1', '1/1']
+	with open(os.path.join(out_dir, 'parents.vcf'), 'w') as f:
+		print('##fileformat=VCFv4.2', file = f)
+		print('##contig=<ID=' + chrom + ',length=' + str(contig_length) + '>', file = f)
+		print('##INFO=<ID=TYPE,Number=A,Type=String,Description="The type of allele">', file = f)
+		print('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">', file = f)
+		print('#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT', 'M01', 'F01', sep = '\t', file = f)
+		for i, position in enumerate(sites):
+			if i % 3 == 0: # informative for the fetal fraction
+				maternal_gt, paternal_gt = rng.choice([('0/0', '1/1'), ('1/1', '0/0')])
+			else:
+				maternal_gt, paternal_gt = rng.choice(genotypes), rng.choice(genotypes)
+			print(chrom, position, '.', 'A', 'C', '50', '.', 'TYPE=snp', 'GT', maternal_gt, paternal_gt, sep = '\t', file = f)
+	pysam.tabix_index(os.path.join(out_dir, 'parents.vcf'), preset = 'vcf', force = True)
+
+	with open(os.path.join(out_dir, 'debug.txt'), 'w') as f:
+		print('##fileformat=VCFv4.2', file = f)
+		print('##INFO=<ID=TYPE,Number=A,Type=String,Description="The type of allele">', file = f)
+		print('#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT', 'cfdna', sep = '\t', file = f)
+		for position in sites:
+			reads = site_reads[position]
+			if not reads:
+				continue
+			print('position: ' + chrom + ':' + str(position) + ' coverage: ' + str(len(reads)), file = f)
+			for read_name, base, is_reverse in reads:
+				read = ':'.join(['cfdna', read_name, str(position), '1', '1X', 'snp', '-' if is_reverse else '+', '60', '40', '0', '0', '1'])
+				print('haplo_obs', str(position), '1', base, read, sep = '\t', file = f)
+			print(chrom, position, '.', 'A', 'C', '50', '.', 'DP=' + str(len(reads)) + ';TYPE=snp', 'GT:DP', '0/1:' + str(len(reads)), sep = '\t', file = f)
+
+	return out_dir
@@ -7,11 +7,13 @@ parser = argparse.ArgumentParser()
 
 parser.add_argument("-f", "--fetal_sample_name", default = 'FETUS', help = 'fetal sample name to write in the outputvcf')
 parser.add_argument("-parents_vcf", "--parents_vcf", help = 'The maternal plasma cfDNA VCF file')
+parser.add_argument("-parents_index", "--parents_index", default = False, help = 'index of the parents vcf, made by parents_index.py. if given, parental genotypes are read from it')
 parser.add_argument("-cfdna_vcf", "--cfdna_vcf", help = 'The maternal plasma cfDNA VCF file')
-parser.add_argument("-cfdna_bam", "--cfdna_bam", help = 'The maternal plasma cfDNA BAM file')
+parser.add_argument("-cfdna_bam", "--cfdna_bam", help = 'The maternal plasma cfDNA BAM file. not read when calling genotypes, which uses the database of the patch')
 parser.add_argument("-t", "--tmp_dir", default = tmp_dir, help = 'Directory for temporary files')
-parser.add_argument("-M", "--max_used_reads", default = 1000, help =  'if a loci is covered by more than M reads, \
-									sample only M reads. default: 1000')
+parser.add_argument("-M", "--max_used_reads", type = int, default = 1000, help =  'if a loci is covered by more than M reads, \
+									sample only M reads (0 to use all the reads). default: 1000')
+parser.add_argument("--seed", type = int, default = 0, help = 'random seed for the sampling of reads of -M. default: 0')
 parser.add_argument("-o", "--vcf_output", default = False, help = 'path for vcf output')
 parser.add_argument("-r", "--region", default = False, help = "run on a specific region as explained in pyvcf documentation")
 parser.add_argument("-v", "--verbosity", action = 'store_true', help = "Prints more detailed debugging information")
@@ -20,7 +22,10 @@ parser.add_argument("-%", "--fetal_fraction", default = False, help = "specify a
 parser.add_argument("-P", "--use_prior_ff_dist", default = False, action = 'store_true', help = "whether to user a prior, known length ratios distribution")
 parser.add_argument("-l", "--plot_lengths", default = False, action = 'store_true', help = "Creates a plot of the length distributions")
 parser.add_argument("-q", "--qnames", default = False, action = 'store_true', help = "Creates lists of fetal and shared qnames")
+parser.add_argument("-qz", "--gzip_qnames", default = False, action = 'store_true', help = "gzip the lists of fetal and shared qnames (-q)")
 parser.add_argument("-d", "--db", default = os.path.join(tmp_dir, 'hoobari.db'), help = 'db path')
+parser.add_argument("-pp", "--preprocessing_file", default = False, help = 'json file of the pre-processing results, shared by the jobs of \
+									the same databases. default: TMP_DIR/preprocessing.json, see hoobari-preprocess')
 parser.add_argument("-@", "--cores", default = 1, help = 'number of cores to run pre-processing when run split')
 parser.add_argument("-model", "--model", default = 'lengths', help = '	model for likelihoods calculation. possible values: "simple" \
 									(Bayesian model based only on fetal fraction and parental genotypes), \
@@ -1,14 +1,315 @@
 import sqlite3
 import os
-import pandas as pd
+import sys
+from urllib.request import pathname2url
+import hashlib
+import math
+import random
+import heapq
+from bisect import bisect_left
+from itertools import islice, chain
+from collections import Counter
+from functools import lru_cache
+import numpy as np
 from sys import stderr
 
+# PRAGMAs used while bulk-loading a fresh database. The database is rebuilt from
+# freebayes if the patch crashes, so durability is traded for write speed.
+BULK_INGEST_PRAGMAS = ( 'PRAGMA journal_mode = OFF',
+                        'PRAGMA synchronous = OFF',
+                        'PRAGMA cache_size = -262144', # in KiB, i.e. 256 MiB
+                        'PRAGMA temp_store = MEMORY')
+
+# PRAGMAs of a database that is opened for reading only (read_only=True), e.g. by hoobari's
+# region jobs. The file is memory-mapped, so parallel jobs share its pages in the OS page cache.
+READ_ONLY_PRAGMAS = (   'PRAGMA query_only = ON',
+                        'PRAGMA mmap_size = 17179869184', # 16 GiB of address space, not memory. sqlite caps it at SQLITE_MAX_MMAP_SIZE
+                        'PRAGMA cache_size = -65536', # in KiB, i.e. 64 MiB
+                        'PRAGMA temp_store = MEMORY')
+
+# the number of prepared statements that a connection keeps for reuse
+CACHED_STATEMENTS = 256
+
+# number of rows read in each block of FragmentStore.iterRegionBlocks (sqlite positions are queried one by one)
+BLOCK_ROWS = 100000
+
+# the least number of bp after the first position of a fragment at which LengthHistograms
+# still expects its rows, for fragments whose template length is shorter than their reads
+FRAGMENT_WINDOW = 1000
+
+INSERT_VARIANTS_QUERY = '''
+    INSERT INTO variants
+    (fragment_id, chromosome, pos, genotype, strand, length, for_ff, is_fetal)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+
+INSERT_QNAME_NAMES_QUERY = 'INSERT OR IGNORE INTO qname_names (fragment_id, qname) VALUES (?, ?)'
+
+# The schema of the sqlite database, kept in its PRAGMA user_version. Databases of older versions
+# of hoobari have user_version 0, and their version is told by the variants table.
+# 1 - read names in the qname columns of the variants and qnames tables
+# 2 - 64-bit fragment ids (fragment_id) instead of the read names
+# 3 - the covering index idx_variants_rows instead of idx_chrom_pos
+SCHEMA_VERSION = 3
+
+# The catalogue of a database that was merged from per-region databases (mergeRegion). start and
+# end are those of the region's name, and n_rows the number of its rows in the variants table
+CREATE_REGIONS_TABLE = '''CREATE TABLE regions(
+    region TEXT PRIMARY KEY,
+    chromosome char(2) DEFAULT NULL,
+    start int(10) DEFAULT NULL,
+    end int(10) DEFAULT NULL,
+    n_rows INTEGER NOT NULL
+    )'''
+
+# The rows of a position are read from this index alone, without going to the table.
+# fragment_id is for the join with the qnames table of the origin model
+COVERING_INDEX = '''CREATE INDEX IF NOT EXISTS idx_variants_rows ON variants
+    (chromosome, pos, genotype, length, is_fetal, fragment_id)'''
+
+# A read name is stored as a 64-bit fragment id, a hash of the name. It is the same in every
+# database, so fragments can be matched between the databases of different regions.
+# Reads are looked up at many consecutive positions, hence the cache.
+@lru_cache(maxsize = 1 << 16)
+def fragment_id(qname):
+    return int.from_bytes(hashlib.blake2b(qname.encode(), digest_size = 8).digest(), 'little', signed = True)
+
+def schema_version(con, schema='main'):
+    '''
+    the schema version of a database of the connection (schema is its name, for attached
+    databases), or 0 if it has no variants table
+    '''
+    version = con.execute('PRAGMA ' + schema + '.user_version').fetchone()[0]
+    if version == 0:
+        columns = [row[1] for row in con.execute('PRAGMA ' + schema + '.table_info(variants)')]
+        if columns:
+            version = 1 if 'qname' in columns else 2
+    return version
+
+def is_merged_db(dbpath):
+    '''
+    whether dbpath is a sqlite database merged from per-region databases by scripts/hoobari-merge-db
+    '''
+    if not os.path.isfile(dbpath):
+        return False
+    con = sqlite3.connect('file:' + pathname2url(os.path.abspath(dbpath)) + '?mode=ro', uri = True)
+    try:
+        return bool(con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='regions'").fetchall())
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        con.close()
+
+def open_db(dbpath, probe=True, backend=None, **kwargs):
+    '''
+    returns the database at dbpath, as a Variants object or as a fragment_store.FragmentStore,
+    which have the same methods.
+    backend - 'sqlite' or 'columnar', the backend of a new database (probe=True). An existing
+    database is opened with the backend it was written with.
+    '''
+    from fragment_store import FragmentStore, is_fragment_store
+
+    if probe:
+        use_store = backend == 'columnar'
+    else:
+        use_store = is_fragment_store(dbpath)
+
+    if use_store:
+        return FragmentStore(dbpath, probe=probe, **kwargs)
+    else:
+        return Variants(dbpath, probe=probe, **kwargs)
+
+def position_seed(seed, chromosome, position):
+    '''
+    the seed of the subsampling of a position's rows, so that it doesn't depend on the other positions
+    '''
+    return '{}:{}:{}'.format(seed, chromosome, int(position))
+
+def reservoir_sample(rows, max_rows, seed):
+    '''
+    a uniform random sample of max_rows of rows, an iterable that is read once (like a cursor), with
+    reservoir sampling (Algorithm L). the rows between the sampled ones are skipped without being kept,
+    so at most max_rows rows are held. the sample is in the order of rows, and depends only on the
+    seed and the number of rows. returns the sample, and whether there were more than max_rows rows.
+    '''
+    rows = iter(rows)
+    reservoir = list(islice(rows, max_rows))
+    extra_row = next(rows, None)
+    if extra_row is None:
+        return reservoir, False
+
+    rng = random.Random(seed)
+    indices = list(range(max_rows))
+    rows = chain([extra_row], rows)
+    i = max_rows - 1
+    w = math.exp(math.log(1 - rng.random()) / max_rows)
+    while True:
+        skip = int(math.log(1 - rng.random()) / math.log(1 - w))
+        row = next(islice(rows, skip, None), None)
+        if row is None:
+            break
+        i += skip + 1
+        slot = rng.randrange(max_rows)
+        reservoir[slot], indices[slot] = row, i
+        w *= math.exp(math.log(1 - rng.random()) / max_rows)
+    return [row for index, row in sorted(zip(indices, reservoir), key = lambda x: x[0])], True
+
+class VariantBlock(object):
+    '''
+    the rows (genotype, length, is_fetal) of consecutive positions, sorted by position. the rows of
+    positions[i] are offsets[i]:offsets[i + 1], either of rows, a list of row tuples, or of arrays,
+    a (genotypes, lengths, is_fetal) tuple of arrays. capped are the positions whose rows were
+    subsampled (see iterRegionBlocks' max_rows).
+    '''
+    def __init__(self, positions, offsets, rows=None, arrays=None, capped=()):
+        self.positions = positions
+        self.offsets = offsets
+        self._rows = rows
+        self._arrays = arrays
+        self.capped = capped
+
+    def last_position(self):
+        return self.positions[-1]
+
+    def rows(self, position):
+        '''
+        the rows of a position, like getPositionVariants(...).fetchall() returns them
+        '''
+        i = bisect_left(self.positions, position)
+        if i == len(self.positions) or self.positions[i] != position:
+            return []
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if self._rows is not None:
+            return self._rows[start:end]
+        return list(zip(*(a[start:end].tolist() for a in self._arrays)))
+
+class RegionVariants(object):
+    '''
+    serves the rows of each position, like getPositionVariants, from the blocks of ordered scans
+    (vardb.iterRegionBlocks) instead of a query per position. positions are expected in
+    increasing order within a chromosome; another chromosome, or going back, starts a new scan.
+    start and end (0-based, half-open) limit the scans to a region. positions with more than
+    max_rows rows get a sample of max_rows of them (see reservoir_sample), and are counted in n_capped.
+    sqlite databases have no region scan, as an indexed query per position is as fast there
+    (see benchmarks/bench_region_variants.py), so their positions are queried one by one.
+    '''
+    def __init__(self, vardb, model, start = None, end = None, max_rows = None, seed = 0):
+        self.vardb = vardb
+        self.model = model
+        self.start = start
+        self.end = end
+        self.max_rows = max_rows
+        self.seed = seed
+        self.n_capped = 0
+        self.chromosome = None
+        self.position = None
+        self.block = None
+        self.blocks = iter(())
+
+    def _scan(self, chromosome, position):
+        self.chromosome = chromosome
+        start = position - 1 if self.start is None else max(self.start, position - 1)
+        self.blocks = self.vardb.iterRegionBlocks(chromosome, start, self.end, self.model, max_rows = self.max_rows, seed = self.seed)
+        self.block = next(self.blocks, None)
+
+    def get(self, chromosome, position):
+        position = int(position)
+        if not hasattr(self.vardb, 'iterRegionBlocks'):
+            return self._query(chromosome, position)
+        if chromosome != self.chromosome or position < self.position:
+            self._scan(chromosome, position)
+        self.position = position
+        while self.block is not None and self.block.last_position() < position:
+            self.block = next(self.blocks, None)
+        if self.block is None:
+            return []
+        if position in self.block.capped:
+            self.n_capped += 1
+        return self.block.rows(position)
+
+    def _query(self, chromosome, position):
+        cursor = self.vardb.getPositionVariants(chromosome, position, self.model)
+        if not self.max_rows:
+            return cursor.fetchall()
+        rows, capped = reservoir_sample(cursor, self.max_rows, position_seed(self.seed, chromosome, position))
+        self.n_capped += capped
+        return rows
+
+class LengthHistograms(object):
+    '''
+    length counts of the fetal (for_ff=1) and shared (for_ff=2) fragments, kept while the
+    variants are inserted. like the fetal_lengths and shared_lengths views, every distinct fragment
+    is counted once, with the length of one of its rows (here, of the first one inserted).
+    the rows of a fragment are at the positions it covers, so a fragment is only remembered until
+    the inserted positions pass its first position plus its length (or FRAGMENT_WINDOW), and memory
+    is bounded by the fragments around the current position. positions are expected in increasing
+    order within a chromosome, as the patch inserts them; another chromosome starts over.
+    '''
+    def __init__(self):
+        self.counts = {1: Counter(), 2: Counter()}
+        self.chromosome = None
+        self.position = None
+        self.fragment_ends = {1: {}, 2: {}} # for_ff -> {fragment: the last position its rows are expected at}
+        self.ends_heap = [] # (end, for_ff, fragment)
+
+    def add(self, chromosome, position, fragment, length, for_ff):
+        if position != self.position or chromosome != self.chromosome:
+            self._move(chromosome, position)
+        fragment_ends = self.fragment_ends.get(int(for_ff))
+        if fragment_ends is not None and fragment not in fragment_ends:
+            end = position + max(int(length), FRAGMENT_WINDOW)
+            fragment_ends[fragment] = end
+            heapq.heappush(self.ends_heap, (end, int(for_ff), fragment))
+            self.counts[int(for_ff)][length] += 1
+
+    def _move(self, chromosome, position):
+        if chromosome != self.chromosome:
+            self.chromosome = chromosome
+            self.fragment_ends = {1: {}, 2: {}}
+            self.ends_heap = []
+        self.position = position
+        # forget the fragments that ended before the position
+        while self.ends_heap and self.ends_heap[0][0] < position:
+            end, for_ff, fragment = heapq.heappop(self.ends_heap)
+            del self.fragment_ends[for_ff][fragment]
+
+    def fetal(self):
+        return sorted(self.counts[1].items())
+
+    def shared(self):
+        return sorted(self.counts[2].items())
+
 class Variants(object):
-    def __init__(self, dbpath = './hoobari.db', probe=True):
+    def __init__(self, dbpath = './hoobari.db', probe=True, bulk=False, batch_size=1000, qnames=False, read_only=False):
+        '''
+        probe - create a new (empty) database at dbpath. Otherwise connect to an existing one.
+        bulk - ingest mode for a new database: insertVariant buffers rows and writes them with
+        executemany, one transaction per batch_size positions, and the index is only built
+        by finishBulkInsert, after the load.
+        qnames - keep the read names of the fragment ids in the qname_names table, for hoobari's
+        --qnames output.
+        read_only - open an existing database (probe=False) for queries only. It is opened as an
+        immutable file, without locks, so it must not be written while it is open. Databases of
+        an unreadable schema version are rejected (see checkSchema and migrate).
+        '''
+
+        self.bulk = bulk and probe
+        self.batch_size = batch_size
+        self.qnames = qnames
+        self._batch = []
+        self._batch_names = {}
+        self._batch_positions = 0
+        self.length_histograms = LengthHistograms()
 
         if not probe:
             # Connect to DB only of it exists            
-            if os.path.isfile(dbpath):
+            if os.path.isfile(dbpath) and read_only:
+                uri = 'file:' + pathname2url(os.path.abspath(dbpath)) + '?mode=ro&immutable=1'
+                self.con = sqlite3.connect(uri, uri = True, isolation_level = None, cached_statements = CACHED_STATEMENTS)
+                for pragma in READ_ONLY_PRAGMAS:
+                    self.con.execute(pragma)
+                self.checkSchema(dbpath)
+            elif os.path.isfile(dbpath):
                 self.con = sqlite3.connect(dbpath, isolation_level = None)
             else:
                 print('missing database file:', dbpath, file=stderr)
@@ -24,34 +325,52 @@ class Variants(object):
             for res in res_list:
                 self.con.execute('DROP ' + res[0] + ' IF EXISTS ' + res[1])
 
-            #TODO: Are properties like chromosome constant for each qname
-            self.con.execute(   '''CREATE TABLE qnames(
-                                qname varchar(50) PRIMARY KEY,
-                                is_fetal tinyint(1) DEFAULT NULL
-                                )''')
-            # self.con.execute('CREATE INDEX idx_length_fetal ON qnames (length, for_ff)')
-            self.con.execute(   '''CREATE TABLE variants(
-                                qname varchar(50) NOT NULL,
-                                chromosome char(2) DEFAULT NULL,
-                                pos int(10) NOT NULL,
-                                genotype varchar(50) DEFAULT NULL,
-                                strand tinyint(1) DEFAULT NULL,
-                                length int(10) DEFAULT NULL,
-                                for_ff tinyint(1) DEFAULT NULL,
-                                is_fetal tinyint(1) DEFAULT NULL,
-                                FOREIGN KEY(qname) REFERENCES qnames(qname)
-                                )''')
-            self.con.execute('CREATE INDEX idx_chrom_pos ON variants (chromosome, pos)')
+            self.createTables()
+            self.con.execute('PRAGMA user_version = ' + str(SCHEMA_VERSION))
+            if self.bulk:
+                for pragma in BULK_INGEST_PRAGMAS:
+                    self.con.execute(pragma)
+            else:
+                self.createIndex()
             self.con.execute(   '''CREATE TABLE samples(
                                 mother char(20) DEFAULT NULL,
                                 father char(20) DEFAULT NULL)''')
 
+    # Create the qnames and variants tables, and qname_names if the read names are kept
+    def createTables(self):
+        #TODO: Are properties like chromosome constant for each qname
+        self.con.execute(   '''CREATE TABLE qnames(
+                            fragment_id INTEGER PRIMARY KEY,
+                            is_fetal tinyint(1) DEFAULT NULL
+                            )''')
+        # self.con.execute('CREATE INDEX idx_length_fetal ON qnames (length, for_ff)')
+        self.con.execute(   '''CREATE TABLE variants(
+                            fragment_id INTEGER NOT NULL,
+                            chromosome char(2) DEFAULT NULL,
+                            pos int(10) NOT NULL,
+                            genotype varchar(50) DEFAULT NULL,
+                            strand tinyint(1) DEFAULT NULL,
+                            length int(10) DEFAULT NULL,
+                            for_ff tinyint(1) DEFAULT NULL,
+                            is_fetal tinyint(1) DEFAULT NULL,
+                            FOREIGN KEY(fragment_id) REFERENCES qnames(fragment_id)
+                            )''')
+        if self.qnames:
+            self.con.execute(   '''CREATE TABLE qname_names(
+                                fragment_id INTEGER PRIMARY KEY,
+                                qname TEXT NOT NULL
+                                )''')
+
     # Insert variants to table
     def insertVariant(self, chromosome, position, info_list):
 
+        if self.bulk:
+            self.bufferVariant(chromosome, position, info_list)
+            return
+
         query = '''
             INSERT INTO `variants`
-            (qname,
+            (fragment_id,
             chromosome,
             pos,
             genotype,
@@ -65,54 +384,209 @@ class Variants(object):
 
         for line in info_list:
             geno, isize, qname, strand, is_fetal, for_ff = line
-            query += '("{0}","{1}",{2},"{3}",{4},{5},{6},{7}),'.format(qname,
+            self.length_histograms.add(chromosome, position, fragment_id(qname), isize, for_ff)
+            query += '({0},"{1}",{2},"{3}",{4},{5},{6},{7}),'.format(fragment_id(qname),
                     chromosome, position, geno, strand, isize, for_ff, is_fetal)
 
         query = query[:-1]
         self.con.execute(query)
+        if self.qnames:
+            self.con.executemany(INSERT_QNAME_NAMES_QUERY, [(fragment_id(line[2]), line[2]) for line in info_list])
         self.con.commit()
 
+    # Buffer variants of a position for a batched insert (bulk mode)
+    def bufferVariant(self, chromosome, position, info_list):
+        for geno, isize, qname, strand, is_fetal, for_ff in info_list:
+            qname_id = fragment_id(qname)
+            self._batch.append((qname_id, chromosome, position, geno, strand, isize, for_ff, is_fetal))
+            self.length_histograms.add(chromosome, position, qname_id, isize, for_ff)
+            if self.qnames:
+                self._batch_names[qname_id] = qname
+        self._batch_positions += 1
+        if self._batch_positions >= self.batch_size:
+            self.flush()
+
+    # Write all buffered variants in a single transaction
+    def flush(self):
+        if self._batch:
+            self.con.execute('BEGIN')
+            self.con.executemany(INSERT_VARIANTS_QUERY, self._batch)
+            if self._batch_names:
+                self.con.executemany(INSERT_QNAME_NAMES_QUERY, self._batch_names.items())
+            self.con.execute('COMMIT')
+        self._batch = []
+        self._batch_names = {}
+        self._batch_positions = 0
+
+    def createIndex(self):
+        self.con.execute(COVERING_INDEX)
+
+    # Exit if the database can't be read by this version of hoobari, and warn if it's readable but
+    # older than SCHEMA_VERSION
+    def checkSchema(self, dbpath):
+        version = schema_version(self.con)
+        if version > SCHEMA_VERSION:
+            sys.exit(dbpath + ' was built by a newer version of hoobari (schema version ' + str(version) + ')')
+        elif 0 < version < 2:
+            sys.exit(dbpath + ' was built by an older version of hoobari (schema version ' + str(version) + '). ' +
+                     'Upgrade it with scripts/hoobari-migrate-db, or build it again')
+        elif 0 < version < SCHEMA_VERSION:
+            print(dbpath, 'has schema version', version, 'and is read slower than version', SCHEMA_VERSION,
+                  '- upgrade it with scripts/hoobari-migrate-db', file=stderr)
+
+    # Upgrade an existing database (probe=False, not read_only) in place to SCHEMA_VERSION.
+    # Returns the version it had
+    def migrate(self):
+        version = schema_version(self.con)
+        if version == 0 or version > SCHEMA_VERSION:
+            raise ValueError('not a database of this version of hoobari (schema version ' + str(version) + ')')
+
+        self.con.execute('PRAGMA cache_size = -262144') # in KiB, i.e. 256 MiB
+        self.con.execute('PRAGMA temp_store = MEMORY')
+        self.con.execute('BEGIN')
+        if version < 2:
+            self.migrateQnames()
+        if version < 3:
+            self.con.execute('DROP INDEX IF EXISTS idx_chrom_pos')
+            self.createIndex()
+        self.con.execute('PRAGMA user_version = ' + str(SCHEMA_VERSION))
+        self.con.execute('COMMIT')
+        return version
+
+    # Replace the read names of a version 1 database with fragment ids, and keep the names in
+    # the qname_names table
+    def migrateQnames(self):
+        self.con.create_function('fragment_id', 1, fragment_id, deterministic = True)
+        views = [row[0] for row in self.con.execute("SELECT name FROM sqlite_master WHERE type='view'")]
+        for view in views:
+            self.con.execute('DROP VIEW ' + view)
+        self.con.execute('DROP INDEX IF EXISTS idx_chrom_pos')
+        self.con.execute('ALTER TABLE variants RENAME TO qname_variants')
+        self.con.execute('ALTER TABLE qnames RENAME TO qname_qnames')
+
+        self.qnames = True
+        self.createTables()
+        self.con.execute('''INSERT INTO variants
+                            SELECT fragment_id(qname), chromosome, pos, genotype, strand, length, for_ff, is_fetal
+                            FROM qname_variants
+                            ORDER BY rowid''')
+        self.con.execute('''INSERT INTO qnames
+                            SELECT fragment_id(qname), max(is_fetal)
+                            FROM qname_qnames
+                            GROUP BY 1''')
+        self.con.execute('''INSERT OR IGNORE INTO qname_names
+                            SELECT fragment_id(qname), qname
+                            FROM qname_variants''')
+        self.con.execute('DROP TABLE qname_variants')
+        self.con.execute('DROP TABLE qname_qnames')
+        if 'fetal_lengths' in views or 'shared_lengths' in views:
+            self.createLengthViews()
+
+    # End a bulk load: write the remaining rows and build the index over the loaded table
+    def finishBulkInsert(self):
+        self.flush()
+        self.createIndex()
+        self.bulk = False
+
     # Create qnames table for origin model
     def createQnamesTable(self):
         self.con.execute('''INSERT INTO qnames 
-                                    SELECT qname, max(is_fetal) 
+                                    SELECT fragment_id, max(is_fetal) 
                                     from variants 
-                                    group by qname''')
+                                    group by fragment_id''')
 
-    # Create views for both shared and fetal lengths
+    # Create views for both shared and fetal lengths, and write the length counts that were kept
+    # during the insert, instead of counting the views
     def lengthDists(self):
+        self.createLengthViews()
+        for table, counts in (('fetal_length_counts', self.length_histograms.fetal()),
+                              ('shared_length_counts', self.length_histograms.shared())):
+            self.con.execute('CREATE TABLE ' + table + '(length int(10), "COUNT(length)" INTEGER)')
+            self.con.execute('BEGIN')
+            self.con.executemany('INSERT INTO ' + table + ' VALUES (?, ?)', counts)
+            self.con.execute('COMMIT')
+
+    # Append the per-region database at dbpath to a new database (probe=True), and add the region
+    # to its regions table. The region's length counts are added to length_histograms, so that
+    # lengthDists writes their sums, like preprocessing adds up the counts of the region databases.
+    # A fragment of the qnames table is fetal if it is fetal in any of the regions.
+    def mergeRegion(self, dbpath, region, chromosome, start, end):
+        self.con.execute('ATTACH DATABASE ? AS region_db', (dbpath,))
+        version = schema_version(self.con, 'region_db')
+        if not 2 <= version <= SCHEMA_VERSION:
+            raise ValueError(dbpath + ' has schema version ' + str(version) + ', upgrade it with scripts/hoobari-migrate-db')
+        samples = self.con.execute('SELECT * FROM region_db.samples').fetchall()
+        if samples != self.con.execute('SELECT * FROM samples').fetchall() and self.getRegions():
+            raise ValueError(dbpath + ' is of other parental samples: ' + ', '.join(map(str, samples[0] if samples else ())))
+        length_counts = {for_ff: dict(self.con.execute('SELECT * FROM region_db.' + table))
+                         for table, for_ff in (('fetal_length_counts', 1), ('shared_length_counts', 2))}
+        has_names = self.con.execute("SELECT 1 FROM region_db.sqlite_master WHERE type='table' AND name='qname_names'").fetchall()
+
+        self.con.execute('BEGIN')
+        n_rows = self.con.execute('''INSERT INTO variants
+                                     SELECT fragment_id, chromosome, pos, genotype, strand, length, for_ff, is_fetal
+                                     FROM region_db.variants
+                                     ORDER BY chromosome, pos''').rowcount
+        self.con.execute('''INSERT INTO qnames
+                            SELECT fragment_id, is_fetal FROM region_db.qnames WHERE true
+                            ON CONFLICT(fragment_id) DO UPDATE SET is_fetal=max(is_fetal, excluded.is_fetal)''')
+        if self.qnames and has_names:
+            self.con.execute('INSERT OR IGNORE INTO qname_names SELECT fragment_id, qname FROM region_db.qname_names')
+        if not self.getRegions():
+            self.con.execute('DELETE FROM samples')
+            self.con.executemany('INSERT INTO samples (mother, father) VALUES (?, ?)', samples)
+        self.con.execute('INSERT INTO regions VALUES (?, ?, ?, ?, ?)', (region, chromosome, start, end, n_rows))
+        self.con.execute('COMMIT')
+        self.con.execute('DETACH DATABASE region_db')
+
+        for for_ff, counts in length_counts.items():
+            self.length_histograms.counts[for_ff].update(counts)
+
+    # Create the regions table of a database that is merged from per-region databases
+    def createRegionsTable(self):
+        self.con.execute(CREATE_REGIONS_TABLE)
+
+    # Gets the regions of a merged database, as (region, chromosome, start, end, n_rows) rows
+    def getRegions(self):
+        return self.con.execute('SELECT * FROM regions').fetchall()
+
+    def createLengthViews(self):
         self.con.execute('''
-        CREATE VIEW fetal_lengths AS SELECT length, qname FROM variants WHERE for_ff=1 GROUP BY qname
+        CREATE VIEW fetal_lengths AS SELECT length, fragment_id FROM variants WHERE for_ff=1 GROUP BY fragment_id
         ''')
-        self.con.execute("""
-                        CREATE TABLE fetal_length_counts
-                        AS SELECT length, COUNT(length)
-                        FROM fetal_lengths
-                        GROUP BY length
-                        """)
         self.con.execute('''
-        CREATE VIEW shared_lengths AS SELECT length, qname FROM variants WHERE for_ff=2 GROUP BY qname
+        CREATE VIEW shared_lengths AS SELECT length, fragment_id FROM variants WHERE for_ff=2 GROUP BY fragment_id
         ''')
-        self.con.execute("""
-                        CREATE TABLE shared_length_counts
-                        AS SELECT length, COUNT(length)
-                        FROM shared_lengths
-                        GROUP BY length
-                        """)
 
     # Get fetal lengths
     def getFetalLengths(self):
+        import pandas as pd
         return pd.read_sql_query("select * from fetal_length_counts", self.con).set_index('length')
 
     # Get shared lengths
     def getSharedLengths(self):
+        import pandas as pd
         return pd.read_sql_query("select * from shared_length_counts", self.con).set_index('length')
 
-    # Gets fetal and shared qnames
+    # Whether the read names of the fragment ids are kept (qname_names)
+    def hasReadNames(self):
+        return bool(self.con.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='qname_names'").fetchall())
+
+    # Yields the qnames of the fetal or the shared fragments (name is 'fetal' or 'shared'), without
+    # holding them in memory. Without the qname_names table, these are the fragment ids
+    def iterQnames(self, name):
+        if self.hasReadNames():
+            query = "SELECT n.qname FROM {0}_lengths l, qname_names n WHERE n.fragment_id=l.fragment_id"
+        else:
+            query = "SELECT fragment_id FROM {0}_lengths"
+        for row in self.con.execute(query.format(name)):
+            yield row[0]
+
+    # Gets fetal and shared qnames. Without the qname_names table, these are the fragment ids
     def getFetalSharedQnames(self):
-        fetal_qnames = set([i[0] for i in self.con.execute("SELECT DISTINCT(qname) FROM fetal_lengths")])
-        shared_qnames = set([i[0] for i in self.con.execute("SELECT DISTINCT(qname) FROM shared_lengths")])
-        return fetal_qnames, shared_qnames
+        if not self.hasReadNames():
+            print('the database has no read names (see the --qnames option of freebayes_patch.py), writing fragment ids instead', file=stderr)
+        return set(self.iterQnames('fetal')), set(self.iterQnames('shared'))
 
     # Gets all variants in specified chromosomal position
     def getPositionVariants(self, chromosome, position, model):
@@ -120,7 +594,7 @@ class Variants(object):
             return self.con.execute("""
                                 SELECT v.genotype, v.length, q.is_fetal
                                 FROM variants v, qnames q
-                                WHERE v.chromosome=:chr AND v.pos=:pos AND q.qname=v.qname
+                                WHERE v.chromosome=:chr AND v.pos=:pos AND q.fragment_id=v.fragment_id
                     """,{"chr":chromosome, "pos":position})
         else:
             return self.con.execute("""
@@ -0,0 +1,137 @@
+'''
+Parser of the freebayes -d debug stream that freebayes_patch.py receives as stdin.
+
+The stream is read in large binary chunks. In each chunk the vcf records (the lines with TYPE=)
+are found with a substring search, and the lines between them are scanned with one precompiled
+pattern that only matches the lines the patch uses, so the rest of the debug output is skipped
+without creating a python object for each of its lines. From every "haplo_obs" line only the
+genotype, qname and strand are extracted, and they are grouped into one PositionRecord per vcf record.
+'''
+
+import re
+
+# lines used by the patch, other than the vcf records. each chunk starts with a newline,
+# so every line is preceded by one.
+LINES_PATTERN = re.compile(r'\n(?:position: |haplo_obs\t|#)[^\n]*')
+
+class PositionRecord(object):
+	'''
+	the reads that freebayes observed at one position, and the vcf record it wrote for it
+	'''
+	__slots__ = ('chrom', 'position', 'genotypes', 'qnames', 'strands', 'vcf_fields')
+
+	def __init__(self, chrom, position):
+		self.chrom = chrom
+		self.position = position
+		self.genotypes = []
+		self.qnames = []
+		self.strands = []
+		self.vcf_fields = None
+
+	def __len__(self):
+		return len(self.qnames)
+
+class DebugStreamParser(object):
+
+	def __init__(self, stream, out = None, debug_out = None, chunk_size = 1 << 23):
+		'''
+		stream - binary stream of freebayes' debug output (e.g. sys.stdin.buffer)
+		out - binary stream to which vcf header lines and vcf records are copied (e.g. sys.stdout.buffer)
+		debug_out - binary stream to which the whole input is copied, for debugging
+		chunk_size - number of bytes read at a time
+		'''
+		self.stream = stream
+		self.out = out
+		self.debug_out = debug_out
+		self.chunk_size = chunk_size
+		self.record = None
+
+	def chunks(self):
+		'''
+		yields chunks of whole lines, decoded and preceded by a newline
+		'''
+		remainder = b''
+		while True:
+			chunk = self.stream.read(self.chunk_size)
+			if not chunk:
+				break
+			if self.debug_out:
+				self.debug_out.write(chunk)
+			last_newline = chunk.rfind(b'\n')
+			if last_newline == -1:
+				remainder += chunk
+				continue
+			yield '\n' + (remainder + chunk[:last_newline]).decode()
+			remainder = chunk[last_newline + 1:]
+		if remainder:
+			yield '\n' + remainder.decode()
+
+	def _scan_lines(self, text):
+		'''
+		collects the reads of "haplo_obs" lines into the current record, and starts
+		a new record at every "position: " line
+		'''
+		record = self.record
+		for line in LINES_PATTERN.findall(text):
+			if line[1] == 'h':
+				# haplo_obs  ?  ?  GENOTYPE  SAMPLE:QNAME:?:?:?:?:STRAND:?:?:?:?:?
+				# qnames may contain colons, so the qname is whatever is left before the last 10 fields
+				if record is not None:
+					fields = line.split('\t', 5)
+					read = fields[4].rsplit(':', 10)
+					record.genotypes.append(fields[3])
+					record.qnames.append(read[0].partition(':')[2])
+					record.strands.append(1 if read[5] == '+' else 0)
+			elif line[1] == 'p':
+				chrom, position = line.split(None, 2)[1].split(':')
+				record = PositionRecord(chrom, position)
+			elif self.out:
+				self.out.write(line[1:].encode() + b'\n')
+		self.record = record
+
+	def positions(self):
+		'''
+		yields a PositionRecord for every vcf record that follows reads observations (haplo_obs lines).
+		records of positions without observations are only passed through.
+		'''
+		for text in self.chunks():
+			scanned_until = 0
+			search_from = 0
+			while True:
+				type_idx = text.find('TYPE=', search_from)
+				if type_idx == -1:
+					break
+				line_start = text.rfind('\n', 0, type_idx)
+				line_end = text.find('\n', type_idx)
+				if line_end == -1:
+					line_end = len(text)
+				search_from = line_end
+				line = text[line_start + 1:line_end]
+				if line.startswith(('#', 'position: ', 'haplo_obs')):
+					continue
+
+				# a vcf record: scan the lines before it, then pass it through and close its position
+				self._scan_lines(text[scanned_until:line_start])
+				scanned_until = line_end
+				if self.out:
+					self.out.write(line.encode() + b'\n')
+				record = self.record
+				self.record = None
+				if record is not None and len(record) > 0:
+					record.vcf_fields = line.rstrip().split('\t')
+					yield record
+
+			self._scan_lines(text[scanned_until:])
+
+	def batches(self, batch_size = 1000):
+		'''
+		yields lists of up to batch_size PositionRecords
+		'''
+		batch = []
+		for record in self.positions():
+			batch.append(record)
+			if len(batch) >= batch_size:
+				yield batch
+				batch = []
+		if batch:
+			yield batch
@@ -0,0 +1,124 @@
+'''
+Downsampling of the fetal fraction, for experiments that simulate a lower fetal fraction than
+the one of a cfDNA sample (freebayes_patch.py --downsample).
+
+The reads of a position are held as arrays (genotypes, template lengths, qnames, strands), and
+all the random draws of a position are made with a few calls to a seedable numpy Generator, so a
+downsampled database is reproducible from its seed.
+'''
+
+import os
+import string
+import numpy as np
+
+# Family G1 length distributions, used by default
+default_length_distributions = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'g1_length_distributions.tsv')
+
+qname_chars = np.frombuffer((string.ascii_uppercase + string.digits).encode(), dtype = np.uint8)
+qname_length = 37
+
+def load_length_distributions(path = default_length_distributions):
+	'''
+	returns the maternal and fetal fragment length distributions (counts per length), as two arrays.
+	path is either a tab separated file with the columns length, maternal and fetal, or a hoobari
+	database (of either backend), in which case the maternal distribution is the shared minus the fetal one.
+	'''
+	if path.endswith('.db') or os.path.isdir(path):
+		import db
+		vardb = db.open_db(path, probe = False, read_only = True)
+		fetal_lengths = vardb.getFetalLengths().iloc[:, 0]
+		shared_lengths = vardb.getSharedLengths().iloc[:, 0]
+		max_length = int(max(fetal_lengths.index.max(), shared_lengths.index.max()))
+		fetal_length_distribution = np.zeros(max_length + 1)
+		shared_length_distribution = np.zeros(max_length + 1)
+		np.add.at(fetal_length_distribution, fetal_lengths.index.astype(int), fetal_lengths.values)
+		np.add.at(shared_length_distribution, shared_lengths.index.astype(int), shared_lengths.values)
+		maternal_length_distribution = np.clip(shared_length_distribution - fetal_length_distribution, 0, None)
+	else:
+		lengths, maternal_length_distribution, fetal_length_distribution = np.loadtxt(path, skiprows = 1, unpack = True)
+		if not np.array_equal(lengths, np.arange(len(lengths))):
+			raise ValueError(path + ' should have one row per length, starting from 0')
+	return maternal_length_distribution, fetal_length_distribution
+
+class Downsampler(object):
+
+	def __init__(self, maternal_length_distribution, fetal_length_distribution, seed = None):
+		self.rng = np.random.default_rng(seed)
+		self.maternal_frequencies = np.asarray(maternal_length_distribution, dtype = np.float64)
+		self.maternal_frequencies = self.maternal_frequencies / self.maternal_frequencies.sum()
+		self.fetal_frequencies = np.asarray(fetal_length_distribution, dtype = np.float64)
+		self.fetal_frequencies = self.fetal_frequencies / self.fetal_frequencies.sum()
+
+	def random_round(self, x):
+		return int(np.floor(x)) if self.rng.integers(2) == 0 else int(np.ceil(x))
+
+	def new_qnames(self, n):
+		codes = qname_chars[self.rng.integers(len(qname_chars), size = (n, qname_length))]
+		return codes.view('S' + str(qname_length)).ravel().astype(str).astype(object)
+
+	def resize_like_maternal(self, isizes, n):
+		'''
+		draw n reads, weighted by how likely their lengths are under the fetal length distribution,
+		and replace their lengths with lengths from the maternal length distribution
+		'''
+		isizes = isizes.copy()
+		lengths = isizes.astype(np.int64)
+		# lengths out of the distribution are replaced by a random fetal length, for the weighting only
+		out_of_range = (lengths < 0) | (lengths >= len(self.fetal_frequencies))
+		lengths[out_of_range] = self.rng.choice(len(self.fetal_frequencies), size = out_of_range.sum(), p = self.fetal_frequencies)
+		weights = self.fetal_frequencies[lengths]
+		n = min(n, np.count_nonzero(weights))
+		if n > 0:
+			idxs = self.rng.choice(len(isizes), size = n, replace = False, p = weights / weights.sum())
+			isizes[idxs] = self.rng.choice(len(self.maternal_frequencies), size = n, p = self.maternal_frequencies)
+		return isizes
+
+	def downsample(self, genotypes, isizes, qnames, strands, F, D, ref, alt, fetal_allele):
+		'''
+		input: the reads of a position as arrays, F - original fetal fraction, D - new fetal fraction,
+		ref and alt alleles and the fetal allele, or 'ambiguous'.
+		returns the downsampled reads, as arrays in the same order (genotypes, isizes, qnames, strands)
+
+		N = original number of fetal reads 
+		n = (D/F) * reads with fetal allele
+		sample n reads from reads with fetal allele
+		for (N - n) reads with shortest isize from the shared list, remove isize and give it one from the maternal size distribution
+		add (N - n) reads to the shared allele:
+		 - qnames are generated randomly
+		 - isizes from the maternal length distribution
+		'''
+		genotypes = np.asarray(genotypes, dtype = object)
+		isizes = np.asarray(isizes, dtype = np.float64)
+		qnames = np.asarray(qnames, dtype = object)
+		strands = np.asarray(strands, dtype = np.int8)
+
+		if fetal_allele == 'ambiguous':
+			# drow n_new_isizes reads from the total allele list using the fetal length
+			# distribution, and replace their isizes with isizes from the maternal length distribution
+			n_new_isizes = self.random_round((D/F) * len(isizes))
+			return genotypes, self.resize_like_maternal(isizes, n_new_isizes), qnames, strands
+
+		# split to fetal and shared reads
+		is_fetal_allele = genotypes == fetal_allele
+		fetal_idxs = np.flatnonzero(is_fetal_allele)
+		shared_idxs = np.flatnonzero(~is_fetal_allele)
+
+		# assemble fetal list
+		n_fetal_original = len(fetal_idxs)
+		F_at_site = (2 * n_fetal_original) / len(genotypes)
+		if F_at_site < 1 and F_at_site > D:
+			F = F_at_site
+		n_fetal_new = min(self.random_round((D/F) * n_fetal_original), n_fetal_original)
+		n_swap = n_fetal_original - n_fetal_new
+		fetal_idxs = self.rng.permutation(fetal_idxs)[:n_fetal_new]
+
+		# drow n_swap reads from the shared allele list using the fetal length
+		# distribution, and replace their isizes with isizes from the maternal length distribution
+		shared_isizes = self.resize_like_maternal(isizes[shared_idxs], min(len(shared_idxs), n_swap))
+
+		# create n_swap new records with the maternal allele
+		maternal_allele = ref if fetal_allele == alt else alt
+		return (np.concatenate([genotypes[shared_idxs], np.full(n_swap, maternal_allele, dtype = object), genotypes[fetal_idxs]]),
+			np.concatenate([shared_isizes, self.rng.choice(len(self.maternal_frequencies), size = n_swap, p = self.maternal_frequencies).astype(np.float64), isizes[fetal_idxs]]),
+			np.concatenate([qnames[shared_idxs], self.new_qnames(n_swap), qnames[fetal_idxs]]),
+			np.concatenate([strands[shared_idxs], self.rng.integers(2, size = n_swap, dtype = np.int8), strands[fetal_idxs]]))
@@ -0,0 +1,84 @@
+'''
+Sorting and deduplication of more strings than fit in memory, for hoobari's lists of fetal and
+shared qnames (hoobari -q). The strings are collected into sorted, deduplicated runs of at most
+run_size strings, each spilled to its own file, and the runs are then merged with a k-way merge
+that holds one line per open file. At most fan_in files are merged at once; if there are more
+runs, they are merged in several passes. Memory is therefore bounded by run_size and fan_in, and
+not by the number of strings.
+'''
+
+import os
+import gzip
+import heapq
+import tempfile
+
+# strings held in memory before they are spilled as a sorted run
+RUN_SIZE = 500000
+
+# runs merged at once
+FAN_IN = 64
+
+class SortedRuns(object):
+	'''
+	collects strings, and writes them to sorted, deduplicated files (runs) in spill_dir, each of
+	at most run_size strings. paths holds the files that were written.
+	'''
+	def __init__(self, spill_dir, run_size = RUN_SIZE):
+		self.spill_dir = spill_dir
+		self.run_size = run_size
+		self.paths = []
+		self._buffer = set()
+
+	def add(self, string):
+		self._buffer.add(string)
+		if len(self._buffer) >= self.run_size:
+			self.flush()
+
+	def update(self, strings):
+		for string in strings:
+			self.add(string)
+
+	def flush(self):
+		if self._buffer:
+			fd, path = tempfile.mkstemp(dir = self.spill_dir, suffix = '.run')
+			with os.fdopen(fd, 'w') as f:
+				for string in sorted(self._buffer):
+					f.write(string + '\n')
+			self.paths.append(path)
+			self._buffer = set()
+		return self.paths
+
+def merge_files(paths, output, compress = False):
+	'''
+	writes the lines of sorted files to the file output, sorted and without duplicates.
+	compress - write it with gzip
+	'''
+	files = [open(path) for path in paths]
+	previous = None
+	with (gzip.open(output, 'wt') if compress else open(output, 'w')) as out:
+		for line in heapq.merge(*files):
+			if line != previous:
+				out.write(line)
+				previous = line
+	for f in files:
+		f.close()
+
+def merge_runs(paths, output, spill_dir, fan_in = FAN_IN, compress = False):
+	'''
+	merges sorted run files into output, at most fan_in at a time. the runs, and the intermediate
+	runs of the passes, are removed.
+	'''
+	paths = list(paths)
+	while len(paths) > fan_in:
+		merged_paths = []
+		for i in range(0, len(paths), fan_in):
+			fd, merged_path = tempfile.mkstemp(dir = spill_dir, suffix = '.run')
+			os.close(fd)
+			merge_files(paths[i:i + fan_in], merged_path)
+			merged_paths.append(merged_path)
+		for path in paths:
+			os.remove(path)
+		paths = merged_paths
+	merge_files(paths, output, compress = compress)
+	for path in paths:
+		os.remove(path)
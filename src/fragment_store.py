@@ -0,0 +1,299 @@
+'''
+A columnar alternative to the sqlite database of db.Variants, with the same interface.
+
+A store is a directory. For each contig it holds one array of fragment-site rows, sorted by position:
+
+    pos int32 | allele int16 | length int16 | flags uint8 | qname_id int32
+
+allele is an index into the store's list of genotype strings, qname_id an index into its array of
+64-bit fragment ids (db.fragment_id, the hash of the read name), and flags holds the strand (bit 0), is_fetal (bit 1) and for_ff (bits 2-3). Next to it,
+the distinct positions of the contig and the offset of each one's first row are kept, so the rows
+of a position are a slice found by binary search. The arrays are opened with numpy's mmap_mode.
+Lengths above the int16 range are stored as 32767. The read names themselves are only kept, in
+qnames.txt, if the store was created with qnames=True.
+'''
+
+import os
+import json
+import shutil
+from array import array
+from sys import stderr
+import numpy as np
+from db import fragment_id, LengthHistograms, VariantBlock, BLOCK_ROWS, reservoir_sample, position_seed
+
+META_FILE = 'store.json'
+STORE_FORMAT = 'hoobari-fragments'
+
+fragments_dtype = np.dtype([('pos', '<i4'),
+                            ('allele', '<i2'),
+                            ('length', '<i2'),
+                            ('flags', 'u1'),
+                            ('qname_id', '<i4')])
+
+STRAND_FLAG = 1
+IS_FETAL_FLAG = 2
+FOR_FF_SHIFT = 2
+MAX_LENGTH = np.iinfo(np.int16).max
+
+def is_fragment_store(path):
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+class Rows(list):
+    '''
+    rows of a query, with the fetchall method of the sqlite cursors returned by db.Variants
+    '''
+    def fetchall(self):
+        return list(self)
+
+class FragmentStore(object):
+    def __init__(self, dbpath = './hoobari.db', probe=True, qnames=False, **kwargs):
+
+        self.dbpath = dbpath
+        self.qnames = qnames
+        self._arrays = {}
+
+        if not probe:
+            # Connect to store only if it exists
+            if is_fragment_store(dbpath):
+                with open(os.path.join(dbpath, META_FILE)) as f:
+                    self.meta = json.load(f)
+                self.alleles = self.meta['alleles']
+            else:
+                print('missing database file:', dbpath, file=stderr)
+        else:
+            # Drop existing store if needed
+            if is_fragment_store(dbpath):
+                shutil.rmtree(dbpath)
+            os.makedirs(dbpath, exist_ok=True)
+
+            self.meta = {'format': STORE_FORMAT, 'version': 1, 'contigs': {}, 'samples': None}
+            self.alleles = []
+            self._allele_codes = {}
+            self._qname_ids = {} # fragment id -> qname_id
+            self._names = [] # read names, by qname_id, if qnames
+            self._columns = {} # contig -> columns of the inserted rows
+            self.length_histograms = LengthHistograms() # of qname_ids
+
+    def _path(self, name):
+        return os.path.join(self.dbpath, name)
+
+    # ---------- writing ----------
+
+    # Insert variants to table
+    def insertVariant(self, chromosome, position, info_list):
+        if chromosome not in self._columns:
+            self._columns[chromosome] = (array('i'), array('h'), array('h'), array('B'), array('i'))
+        positions, alleles, lengths, flags, qname_ids = self._columns[chromosome]
+
+        for geno, isize, qname, strand, is_fetal, for_ff in info_list:
+            if geno not in self._allele_codes:
+                self._allele_codes[geno] = len(self.alleles)
+                self.alleles.append(geno)
+            qname_fragment_id = fragment_id(qname)
+            if qname_fragment_id not in self._qname_ids:
+                self._qname_ids[qname_fragment_id] = len(self._qname_ids)
+                if self.qnames:
+                    self._names.append(qname)
+            qname_id = self._qname_ids[qname_fragment_id]
+            length = min(int(isize), MAX_LENGTH)
+            positions.append(position)
+            alleles.append(self._allele_codes[geno])
+            lengths.append(length)
+            flags.append(int(strand) | (int(is_fetal) << 1) | (int(for_ff) << FOR_FF_SHIFT))
+            qname_ids.append(qname_id)
+            self.length_histograms.add(chromosome, position, qname_id, length, for_ff)
+
+    # Write the inserted rows as sorted per-contig arrays
+    def finishBulkInsert(self):
+        for i, (chromosome, columns) in enumerate(self._columns.items()):
+            fragments = np.zeros(len(columns[0]), dtype = fragments_dtype)
+            for field, column in zip(fragments_dtype.names, columns):
+                fragments[field] = np.frombuffer(column, dtype = column.typecode)
+            fragments = fragments[np.argsort(fragments['pos'], kind = 'stable')]
+            positions, offsets = np.unique(fragments['pos'], return_index = True)
+
+            prefix = 'contig_' + str(i)
+            np.save(self._path(prefix + '.fragments.npy'), fragments)
+            np.save(self._path(prefix + '.positions.npy'), positions)
+            np.save(self._path(prefix + '.offsets.npy'), np.append(offsets, len(fragments)).astype(np.int64))
+            self.meta['contigs'][chromosome] = prefix
+        self._columns = {}
+
+        np.save(self._path('fragment_ids.npy'), np.fromiter(self._qname_ids, dtype = np.int64, count = len(self._qname_ids)))
+        if self.qnames:
+            with open(self._path('qnames.txt'), 'w') as f:
+                for qname in self._names:
+                    print(qname, file = f)
+        self.meta['n_qnames'] = len(self._qname_ids)
+        self._qname_ids = {}
+        self._names = []
+        self.meta['alleles'] = self.alleles
+        self._write_meta()
+
+    def _write_meta(self):
+        with open(self._path(META_FILE), 'w') as f:
+            json.dump(self.meta, f)
+
+    def _all_fragments(self):
+        for chromosome in self.meta['contigs']:
+            yield self._contig_arrays(chromosome)[0]
+
+    # Create qnames table for origin model
+    def createQnamesTable(self):
+        qname_is_fetal = np.zeros(self.meta['n_qnames'], dtype = np.int8)
+        for fragments in self._all_fragments():
+            is_fetal = ((fragments['flags'] & IS_FETAL_FLAG) > 0).astype(np.int8)
+            np.maximum.at(qname_is_fetal, fragments['qname_id'], is_fetal)
+        np.save(self._path('qname_is_fetal.npy'), qname_is_fetal)
+
+    # Write the length counts of both shared and fetal fragments, kept during the insert
+    def lengthDists(self):
+        for name, for_ff in (('fetal', 1), ('shared', 2)):
+            counts = sorted(self.length_histograms.counts[for_ff].items())
+            np.save(self._path(name + '_length_counts.npy'), np.array(counts, dtype = np.int64).reshape(-1, 2).T)
+            qname_ids = [fragments['qname_id'][(fragments['flags'] >> FOR_FF_SHIFT) == for_ff] for fragments in self._all_fragments()]
+            np.save(self._path(name + '_qname_ids.npy'), np.unique(np.concatenate(qname_ids + [np.zeros(0, dtype = np.int32)])))
+
+    def create_samples_table(self, parental_samples):
+        mother, father = parental_samples
+        self.meta['samples'] = [str(mother), str(father)]
+
+    # ---------- reading ----------
+
+    def _contig_arrays(self, chromosome):
+        if chromosome not in self._arrays:
+            if chromosome in self.meta['contigs']:
+                prefix = self._path(self.meta['contigs'][chromosome])
+                self._arrays[chromosome] = (np.load(prefix + '.fragments.npy', mmap_mode = 'r'),
+                                            np.load(prefix + '.positions.npy', mmap_mode = 'r'),
+                                            np.load(prefix + '.offsets.npy', mmap_mode = 'r'))
+            else:
+                self._arrays[chromosome] = None
+        return self._arrays[chromosome]
+
+    def _length_counts(self, name):
+        import pandas as pd
+        length_values, counts = np.load(self._path(name + '_length_counts.npy'))
+        return pd.DataFrame({'length': length_values, 'COUNT(length)': counts}).set_index('length')
+
+    # Get fetal lengths
+    def getFetalLengths(self):
+        return self._length_counts('fetal')
+
+    # Get shared lengths
+    def getSharedLengths(self):
+        return self._length_counts('shared')
+
+    # Whether the read names of the fragments are kept (qnames.txt)
+    def hasReadNames(self):
+        return os.path.isfile(self._path('qnames.txt'))
+
+    # Yields the qnames of the fetal or the shared fragments (name is 'fetal' or 'shared'), reading
+    # qnames.txt line by line. Without it, these are the fragment ids
+    def iterQnames(self, name):
+        qname_ids = np.load(self._path(name + '_qname_ids.npy')) # sorted
+        if self.hasReadNames():
+            i = 0
+            with open(self._path('qnames.txt')) as f:
+                for qname_id, line in enumerate(f):
+                    if i == len(qname_ids):
+                        break
+                    if qname_id == qname_ids[i]:
+                        yield line[:-1]
+                        i += 1
+        else:
+            fragment_ids = np.load(self._path('fragment_ids.npy'), mmap_mode = 'r')
+            for fragment_id in fragment_ids[qname_ids].tolist():
+                yield fragment_id
+
+    # Gets fetal and shared qnames. Without qnames.txt, these are the fragment ids
+    def getFetalSharedQnames(self):
+        if not self.hasReadNames():
+            print('the database has no read names (see the --qnames option of freebayes_patch.py), writing fragment ids instead', file=stderr)
+        return set(self.iterQnames('fetal')), set(self.iterQnames('shared'))
+
+    # Gets all variants in specified chromosomal position
+    def getPositionVariants(self, chromosome, position, model):
+        arrays = self._contig_arrays(chromosome)
+        if arrays is None:
+            return Rows()
+        fragments, positions, offsets = arrays
+        i = np.searchsorted(positions, int(position))
+        if i == len(positions) or positions[i] != int(position):
+            return Rows()
+        rows = fragments[offsets[i]:offsets[i + 1]]
+
+        is_fetal = self._is_fetal(rows, model)
+        if is_fetal is None:
+            return Rows()
+
+        return Rows(zip([self.alleles[a] for a in rows['allele']], rows['length'].tolist(), is_fetal.tolist()))
+
+    def _is_fetal(self, rows, model):
+        '''
+        the is_fetal values of rows. for the origin model, these are of their qnames, and like the
+        join with the qnames table, there are no rows (None) if that table wasn't created.
+        '''
+        if model == 'origin':
+            if not os.path.isfile(self._path('qname_is_fetal.npy')):
+                return None
+            if 'qname_is_fetal' not in self._arrays:
+                self._arrays['qname_is_fetal'] = np.load(self._path('qname_is_fetal.npy'), mmap_mode = 'r')
+            return self._arrays['qname_is_fetal'][rows['qname_id']]
+        else:
+            return (rows['flags'] & IS_FETAL_FLAG) >> 1
+
+    # Yields the variants of a region (0-based, half-open, like in pyvcf's fetch) as
+    # db.VariantBlocks of whole positions, sliced from the contig's arrays. positions with more
+    # than max_rows rows get a sample of their rows (db.reservoir_sample of their indices)
+    def iterRegionBlocks(self, chromosome, start, end, model, block_rows=BLOCK_ROWS, max_rows=None, seed=0):
+        arrays = self._contig_arrays(chromosome)
+        if arrays is None:
+            return
+        fragments, positions, offsets = arrays
+        first = 0 if start is None else np.searchsorted(positions, start, side = 'right')
+        last = len(positions) if end is None else np.searchsorted(positions, end, side = 'right')
+        if 'alleles' not in self._arrays:
+            self._arrays['alleles'] = np.array(self.alleles, dtype = object)
+        while first < last:
+            # the positions whose rows fit in block_rows, and at least one
+            block_last = np.searchsorted(offsets, offsets[first] + block_rows, side = 'right') - 1
+            block_last = min(last, max(first + 1, block_last))
+            block_offsets = offsets[first:block_last + 1]
+            n_rows = np.diff(block_offsets)
+            capped = []
+            if max_rows and n_rows.max() > max_rows:
+                # the rows of the block, with the sampled rows of the capped positions
+                indices = []
+                for position, position_start, position_rows in zip(positions[first:block_last].tolist(), block_offsets.tolist(), n_rows.tolist()):
+                    if position_rows > max_rows:
+                        indices.append(reservoir_sample(range(position_start, position_start + position_rows), max_rows,
+                                                        position_seed(seed, chromosome, position))[0])
+                        capped.append(position)
+                    else:
+                        indices.append(range(position_start, position_start + position_rows))
+                rows = fragments[np.concatenate(indices)]
+                n_rows = np.minimum(n_rows, max_rows)
+                block_offsets = np.concatenate(([0], np.cumsum(n_rows)))
+            else:
+                rows = fragments[offsets[first]:offsets[block_last]]
+                block_offsets = block_offsets - offsets[first]
+            is_fetal = self._is_fetal(rows, model)
+            if is_fetal is None:
+                return
+            yield VariantBlock(positions[first:block_last].tolist(),
+                               block_offsets.tolist(),
+                               arrays = (self._arrays['alleles'][rows['allele']], rows['length'], is_fetal),
+                               capped = set(capped))
+            first = block_last
+
+    # Gets the variants of a region as (pos, genotype, length, is_fetal) rows ordered by position
+    def getRegionVariants(self, chromosome, start, end, model):
+        rows = Rows()
+        for block in self.iterRegionBlocks(chromosome, start, end, model):
+            for position in block.positions:
+                rows.extend((position,) + row for row in block.rows(position))
+        return rows
+
+    def get_samples(self):
+        return tuple(self.meta['samples'])
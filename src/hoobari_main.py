@@ -1,17 +1,11 @@
 # --------- import modules ------------
+# the arguments are parsed before anything else is imported, so that --help and argument errors are immediate
+from arguments import args
 # external
-import re
 import os
 import sys
-import subprocess
-import requests
+from itertools import islice
 import vcf, vcf.utils
-import numpy as np
-import pandas as pd
-from collections import OrderedDict
-import pickle
-import time
-import pysam
 # project's
 import parse_gt
 from stderr import *
@@ -19,23 +13,22 @@ import vcfuid
 import position
 import vcf_out
 import preprocessing
-from arguments import args
-from db import Variants
-
+from parents_index import ParentsIndex
+from ingest import split_region
+from db import open_db, is_merged_db, RegionVariants
 
-def split_region(regionstr):
-	region_split = re.split(':|-', regionstr)
-	chrom = region_split[0]
-	start = int(region_split[1]) if len(region_split) > 1 else None
-	end = int(region_split[2]) if len(region_split) > 2 else None
-	return(chrom, start, end)
 
 # connect to the database that was created during the first analysis of the cfDNA sample
-if args.region:
+# with a region, either the per-region database, or the merged database of scripts/hoobari-merge-db
+if args.region and is_merged_db(args.db):
+	vardb = open_db(args.db, probe=False, read_only=True)
+	if str(args.region) not in [row[0] for row in vardb.getRegions()]:
+		sys.exit('region ' + str(args.region) + ' is not in the merged database ' + args.db)
+elif args.region:
 	args.db = args.tmp_dir
-	vardb = Variants(os.path.join(args.tmp_dir, str(args.region) + '.db'), probe=False)
+	vardb = open_db(os.path.join(args.tmp_dir, str(args.region) + '.db'), probe=False, read_only=True)
 else:
-	vardb = Variants(args.db, probe=False)
+	vardb = open_db(args.db, probe=False, read_only=True)
 
 # pre-processing
 # calculate the total fetal fraction and a table of fetal-fraction per fragment size
@@ -49,7 +42,12 @@ err_rate, total_fetal_fraction, fetal_fractions_df = preprocessing.run_full_prep
 												max_len = 500,
 												plot = args.plot_lengths,
 												qnames = args.qnames,
-												region = args.region)
+												region = args.region,
+												preprocessing_file = args.preprocessing_file or os.path.join(args.tmp_dir, 'preprocessing.json'),
+												gzip_qnames = args.gzip_qnames)
+
+# the fetal fraction of each fragment length is looked up in an array indexed by length
+fetal_fractions = preprocessing.fetal_fractions_lookup(fetal_fractions_df, total_fetal_fraction)
 
 # with open('preprocessing_info.txt', 'w') as pp_info:
 # 	print('total_fetal_fraction', total_fetal_fraction, file = pp_info)
@@ -57,8 +55,6 @@ err_rate, total_fetal_fraction, fetal_fractions_df = preprocessing.run_full_prep
 # 	fetal_fractions_df.to_csv(pp_info, sep = '\t')
 
 
-bam_file_reader = pysam.AlignmentFile(os.path.join(args.cfdna_bam), 'rb')
-
 # create vcf files iterators
 try:
 	cfdna_reader = vcf.Reader(filename = args.cfdna_vcf)
@@ -77,11 +73,12 @@ vcf_out.make_header(	cfdna_reader,
 			output_path = args.vcf_output)
 
 # fetch region, if a region was specified
+region_start = region_end = None
 if args.region:
-	chrom, start, end = split_region(args.region)
+	chrom, region_start, region_end = split_region(args.region)
 	try:
-		cfdna_reader = cfdna_reader.fetch(chrom, start, end)
-		parents_reader = parents_reader.fetch(chrom, start, end)
+		cfdna_reader = cfdna_reader.fetch(chrom, region_start, region_end)
+		parents_reader = parents_reader.fetch(chrom, region_start, region_end)
 	except ValueError as e:
 		errmessage = e.args[0]
 		if 'could not create iterator for region' in errmessage:
@@ -92,63 +89,90 @@ if args.region:
 cfdna_id = cfdna_reader.samples[0]
 mother_id, father_id = vardb.get_samples()	
 
+# parental genotype codes are read from the parents index, if there is one, instead of the parents vcf records.
+# the parents vcf is still read and parsed, since the FORMAT fields and INFO of every parental site are written to the output
+if args.parents_index:
+	parents_index = ParentsIndex(args.parents_index)
+	if not parents_index.has_samples(mother_id, father_id):
+		sys.exit('the parents index was built for samples ' + parents_index.mother + ', ' + parents_index.father)
+
 # processing positions
 # iterate on both vcf files and return a tuple for each position, that contains its record from each vcf file.
 # if there is no vcf record for a certain position in one of the files, a None will appear in the tuple instead.
 co_reader = vcf.utils.walk_together(cfdna_reader, parents_reader)
-for tup in co_reader:
-	# reset prediction and QUAL
-	prediction = qual = None
-	rec_info = []
-
-	cfdna_rec, parents_rec = tup
-
-	printverbose('parents_rec: ', parents_rec)
-	printverbose('cfdna_rec: ', cfdna_rec)
-
-	if not parents_rec:
-		vcf_out.unsupported_position(cfdna_rec, out_path = args.vcf_output)
-	else: # if parental and cfdna record
-
-		# fetch parental genotypes
-		maternal_gt = parse_gt.str_to_int(parents_rec.genotype(mother_id).data.GT)
-		paternal_gt = parse_gt.str_to_int(parents_rec.genotype(father_id).data.GT)
-		printverbose(maternal_gt, paternal_gt)
-
-		
-		if not cfdna_rec:
-			cfdna_rec = parents_rec
-			qual = 0
-			cfdna_geno_sample_dic = '.'
-		elif maternal_gt not in (0,1,2):
-			qual = 0
-			cfdna_geno_sample_dic = '.'
-		else:
-			# for now, only positions where the mother is 0/0, 0/1 or 1/1 are supported
-			if maternal_gt in (0,1,2):
-			
-				# calculate priors for the position
-				priors = position.calculate_priors(maternal_gt, paternal_gt)
-				
-				# calculate likelihoods for the position
-				likelihoods = position.calculate_likelihoods(	cfdna_rec,
-										bam_file_reader,
-										maternal_gt,
-										total_fetal_fraction,
-										fetal_fractions_df,
-										err_rate,
-										vardb,
-										args.model,
-										args.max_used_reads)
-
-				# calculate posteriors for the position
-				posteriors, prediction, qual = position.calculate_posteriors(priors, likelihoods)
+# the db rows of the positions are read in ordered scans of the region, instead of a query per position
+# positions covered by more than args.max_used_reads reads get a sample of them, reproducible from args.seed
+region_variants = RegionVariants(vardb, args.model, region_start, region_end, max_rows = args.max_used_reads, seed = args.seed)
+# the positions are processed in blocks: the likelihoods are calculated for each position, and the
+# posteriors, predictions and QUALs for the whole block at once (position.call_genotypes)
+while True:
+	block = list(islice(co_reader, position.block_size))
+	if not block:
+		break
+
+	# fetch parental genotypes, and calculate the priors and likelihoods of the positions to call
+	parental_gts = []
+	block_priors = []
+	block_likelihoods = []
+	for cfdna_rec, parents_rec in block:
+
+		printverbose('parents_rec: ', parents_rec)
+		printverbose('cfdna_rec: ', cfdna_rec)
+
+		maternal_gt = paternal_gt = None
+		if parents_rec:
+			if args.parents_index:
+				maternal_gt, paternal_gt = parents_index.genotypes(	parents_rec.CHROM,
+											parents_rec.POS,
+											parents_rec.REF,
+											','.join(str(a) for a in parents_rec.ALT))
+			else:
+				maternal_gt = parse_gt.str_to_int(parents_rec.genotype(mother_id).data.GT)
+				paternal_gt = parse_gt.str_to_int(parents_rec.genotype(father_id).data.GT)
+			printverbose(maternal_gt, paternal_gt)
 
+			# for now, only positions where the mother is 0/0, 0/1 or 1/1 are supported
+			if cfdna_rec and maternal_gt in (0,1,2):
 
-				## process the output entry
+				# calculate priors for the position
+				block_priors.append(position.calculate_priors(maternal_gt, paternal_gt))
 
-				# create normalized likelihoods for the output vcf
-				normalized_likelihoods = position.likelihoods_to_phred_scale(likelihoods)
+				# calculate likelihoods for the position
+				block_likelihoods.append(position.calculate_likelihoods(	cfdna_rec,
+												maternal_gt,
+												total_fetal_fraction,
+												fetal_fractions,
+												err_rate,
+												vardb,
+												args.model,
+												args.max_used_reads,
+												pos_data = region_variants.get(cfdna_rec.CHROM.replace('chr', ''), cfdna_rec.POS),
+												seed = args.seed))
+		parental_gts.append((maternal_gt, paternal_gt))
+
+	# calculate posteriors, predictions, QUALs and normalized likelihoods of the block
+	calls = zip(*position.call_genotypes(block_priors, block_likelihoods))
+
+	## process the output entries
+	for (cfdna_rec, parents_rec), (maternal_gt, paternal_gt) in zip(block, parental_gts):
+		# reset prediction and QUAL
+		prediction = qual = None
+		rec_info = []
+
+		if not parents_rec:
+			vcf_out.unsupported_position(cfdna_rec, out_path = args.vcf_output)
+		else: # if parental and cfdna record
+
+			if not cfdna_rec:
+				cfdna_rec = parents_rec
+				qual = 0
+				cfdna_geno_sample_dic = '.'
+			elif maternal_gt not in (0,1,2):
+				qual = 0
+				cfdna_geno_sample_dic = '.'
+			else:
+				prediction, qual, normalized_likelihoods, priors, posteriors = next(calls)
+				qual = position.format_qual(qual)
 
 				# fetal information for the sample and FORMAT fields
 				cfdna_geno_sample_dic = vcf_out.rec_sample_to_string(cfdna_rec, cfdna_id)
@@ -160,18 +184,21 @@ for tup in co_reader:
 
 				rec_info.append(vcf_out.info_to_string(cfdna_rec.INFO))
 
-		# for each parent, for all the data in its sample, create an instance that will be printed in the output INFO
-		rec_info.append(vcf_out.parents_gt_to_info(mother_id, father_id, parents_rec))
-		
-		parental_info_for_info = vcf_out.info_to_string(parents_rec.INFO)
-		parental_info_for_info = 'P' + parental_info_for_info.replace(';',';P')
-		rec_info.append(parental_info_for_info)
-		
-		rec_info = ';'.join(rec_info)
+			# for each parent, for all the data in its sample, create an instance that will be printed in the output INFO
+			rec_info.append(vcf_out.parents_gt_to_info(mother_id, father_id, parents_rec))
+			
+			parental_info_for_info = vcf_out.info_to_string(parents_rec.INFO)
+			parental_info_for_info = 'P' + parental_info_for_info.replace(';',';P')
+			rec_info.append(parental_info_for_info)
+			
+			rec_info = ';'.join(rec_info)
 
-		rec_info = rec_info.replace('None', '.')
+			rec_info = rec_info.replace('None', '.')
 
-		# write var out (to file passed with -v or to output)
-		vcf_out.print_var(cfdna_rec, qual, rec_info, cfdna_geno_sample_dic, out_path = args.vcf_output)
+			# write var out (to file passed with -v or to output)
+			vcf_out.print_var(cfdna_rec, qual, rec_info, cfdna_geno_sample_dic, out_path = args.vcf_output)
 	
+n_capped = region_variants.n_capped + position.n_capped
+if n_capped:
+	printerr(n_capped, 'positions were covered by more than', args.max_used_reads, 'reads, and a sample of them was used')
 printerr('completed successfully')
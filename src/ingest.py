@@ -0,0 +1,126 @@
+'''
+Functions shared by the ingest engines, which build hoobari's database of the cfDNA fragments
+at the parental variant sites: freebayes_patch.py, which parses freebayes' debug output, and
+pileup_ingest.py, which reads the cfDNA bam with pysam.
+'''
+
+import sys
+import os
+import re
+import pysam
+import parse_gt
+
+var_type_dic = {'.': 0, 'snp': 1, 'mnp': 2, 'ins': 3, 'del': 4, 'complex': 5}
+
+def split_region(regionstr):
+	region_split = re.split(':|-', regionstr)
+	chrom = region_split[0]
+	start = int(region_split[1]) if len(region_split) > 1 else None
+	end = int(region_split[2]) if len(region_split) > 2 else None
+	return(chrom, start, end)
+
+def get_var_type(ref, alt):
+	'''
+	the freebayes TYPE of a biallelic site, from its alleles
+	'''
+	if len(ref) == len(alt):
+		return 'snp' if len(ref) == 1 else 'mnp'
+	elif len(ref) < len(alt) and alt.startswith(ref):
+		return 'ins'
+	elif len(ref) > len(alt) and ref.startswith(alt):
+		return 'del'
+	else:
+		return 'complex'
+
+def get_parental_genotypes(parents_reader, parental_samples, chrom, position):
+	maternal_sample_name, paternal_sample_name = parental_samples
+	n_rec = 0
+	for rec in parents_reader.fetch(chrom, int(position) - 1, int(position)):
+		maternal_gt = rec.genotype(maternal_sample_name).data.GT
+		paternal_gt = rec.genotype(paternal_sample_name).data.GT
+		n_rec += 1
+		if n_rec > 1:
+			sys.exit('more than one parental variant in the same position')
+	if n_rec == 0:
+		maternal_gt, paternal_gt = None, None
+	return maternal_gt, paternal_gt
+
+def get_parental_genotypes_from_index(parents_index, chrom, position):
+	sites = parents_index.lookup(chrom, position)
+	if len(sites) > 1:
+		sys.exit('more than one parental variant in the same position')
+	elif len(sites) == 0:
+		return None, None
+	ref, alt, maternal_gt, paternal_gt = sites[0]
+	return parse_gt.int_to_str(maternal_gt), parse_gt.int_to_str(paternal_gt)
+
+def add_fetal_annotations(position_list, maternal_gt, paternal_gt, ref, alt, var_type):
+	for l in position_list:
+		genotype = l[0]	
+		is_fetal = is_fetal_fragment(	genotype,
+						ref,
+						alt,
+						fetal_allele = get_fetal_allele_type(maternal_gt, paternal_gt))
+		for_ff = use_for_fetal_fraction_calculation(	maternal_gt,
+								paternal_gt,
+								var_type,
+								is_fetal)
+		l += [is_fetal if is_fetal is not None else 0, for_ff]
+
+def get_fetal_allele_type(maternal_gt, paternal_gt):
+	if maternal_gt == '0/0' and paternal_gt in ('0/1','1/1'):
+		return 'alt'
+	elif maternal_gt == '1/1' and paternal_gt in ('0/0','0/1'):
+		return 'ref'
+	else:
+		return False
+
+def is_fetal_fragment(genotype, ref, alt, fetal_allele = False):
+
+	if ((genotype == ref) and fetal_allele == 'ref') or ((genotype == alt) and fetal_allele == 'alt'):
+		return 1
+	elif ((genotype == alt) and fetal_allele == 'ref') or ((genotype == ref) and fetal_allele == 'alt'):
+		return 0
+	else:
+		return None
+
+def get_parental_samples_names(m_bam, p_bam):
+	parents_sample_names = []
+	for bam_file in (m_bam, p_bam):
+		bam_file_reader = pysam.AlignmentFile(os.path.join(bam_file), 'rb')
+		sample_name = bam_file_reader.header['RG'][0]['SM']
+		parents_sample_names.append(sample_name)
+		bam_file_reader.close()
+	return parents_sample_names
+
+def use_for_fetal_fraction_calculation(maternal_gt, paternal_gt, var_type, is_fetal):
+	var_in_ff_positions = (maternal_gt == '0/0' and paternal_gt == '1/1') or (maternal_gt == '1/1' and paternal_gt == '0/0')
+	var_is_snp = var_type == 1
+
+	if var_in_ff_positions and var_is_snp:
+		if is_fetal == 1:
+			return 1
+		elif is_fetal == 0:
+			return 2
+		else:
+			return 0
+	else:
+		return 0 # not for ff
+
+def which_allele_is_fetal(maternal_gt, paternal_gt, ref, alt):
+	if maternal_gt == '0/0' and paternal_gt in ('0/1','1/1'):
+		return alt
+	elif maternal_gt == '1/1' and paternal_gt in ('0/0','0/1'):
+		return ref
+	else:
+		return 'ambiguous'
+
+def finish_databases(vardbs, origin = False):
+	for vardb in vardbs:
+		# write the last batch and index the variants table
+		vardb.finishBulkInsert()
+
+		if origin:
+			vardb.createQnamesTable()
+
+		vardb.lengthDists()
@@ -0,0 +1,189 @@
+'''
+A compact, memory-mapped index of the parental genotypes in the parents vcf.
+
+The index is built once per parents vcf:
+
+    python /path/to/hoobari/src/parents_index.py \
+    -parents_vcf parents.vcf.gz \
+    -m MOTHER_SAMPLE \
+    -p FATHER_SAMPLE \
+    -o parents.vcf.gz.hbidx
+
+and then passed to freebayes_patch.py and to hoobari with -parents_index, instead of parsing
+the parents vcf for every site. For each contig it holds one sorted array of sites (position,
+the maternal and paternal genotype codes and the location of the site's alleles in a blob of
+REF/ALT strings). The arrays are opened with numpy's mmap_mode, so all region jobs share the
+same pages of the page cache and opening the index doesn't load it.
+
+Genotype codes are those of parse_gt.str_to_int, with -1 for a missing genotype ('.') and -2
+for an unsupported one.
+'''
+
+import os
+import json
+import argparse
+import numpy as np
+# project's
+import parse_gt
+
+META_FILE = 'meta.json'
+
+MISSING_GT = -1
+UNSUPPORTED_GT = -2
+
+sites_dtype = np.dtype([('pos', '<i4'),
+			('maternal_gt', 'i1'),
+			('paternal_gt', 'i1'),
+			('alleles_offset', '<i8'),
+			('alleles_length', '<u4')])
+
+def default_index_path(parents_vcf):
+	return parents_vcf + '.hbidx'
+
+def gt_to_code(str_gt):
+	gt = parse_gt.str_to_int(str_gt)
+	if gt is None:
+		return MISSING_GT
+	elif gt == 'unsupported':
+		return UNSUPPORTED_GT
+	else:
+		return gt
+
+def code_to_gt(code):
+	'''
+	inverse of gt_to_code, in the form returned by parse_gt.str_to_int
+	'''
+	if code == MISSING_GT:
+		return None
+	elif code == UNSUPPORTED_GT:
+		return 'unsupported'
+	else:
+		return int(code)
+
+def build_parents_index(parents_vcf, maternal_sample_name, paternal_sample_name, index_path = None):
+	import vcf
+
+	if not index_path:
+		index_path = default_index_path(parents_vcf)
+	os.makedirs(index_path, exist_ok = True)
+
+	# collect the sites of every contig, in the order of the vcf
+	contigs = {}
+	for rec in vcf.Reader(filename = parents_vcf):
+		if rec.CHROM not in contigs:
+			contigs[rec.CHROM] = ([], [], [], [])
+		positions, maternal_gts, paternal_gts, alleles = contigs[rec.CHROM]
+		positions.append(rec.POS)
+		maternal_gts.append(gt_to_code(rec.genotype(maternal_sample_name).data.GT))
+		paternal_gts.append(gt_to_code(rec.genotype(paternal_sample_name).data.GT))
+		alleles.append(rec.REF + '\t' + ','.join(str(a) for a in rec.ALT))
+
+	contigs_meta = {}
+	for i, (chrom, (positions, maternal_gts, paternal_gts, alleles)) in enumerate(contigs.items()):
+		order = np.argsort(np.array(positions, dtype = np.int64), kind = 'stable')
+		encoded_alleles = [alleles[j].encode() for j in order]
+
+		sites = np.zeros(len(positions), dtype = sites_dtype)
+		sites['pos'] = np.array(positions)[order]
+		sites['maternal_gt'] = np.array(maternal_gts)[order]
+		sites['paternal_gt'] = np.array(paternal_gts)[order]
+		sites['alleles_length'] = [len(a) for a in encoded_alleles]
+		sites['alleles_offset'] = np.cumsum(sites['alleles_length'], dtype = np.int64) - sites['alleles_length']
+
+		prefix = 'contig_' + str(i)
+		np.save(os.path.join(index_path, prefix + '.sites.npy'), sites)
+		np.save(os.path.join(index_path, prefix + '.alleles.npy'), np.frombuffer(b''.join(encoded_alleles), dtype = np.uint8))
+		contigs_meta[chrom] = {'prefix': prefix, 'n_sites': len(positions)}
+
+	# the meta file is written last, so that an index is only used after it was completely built
+	with open(os.path.join(index_path, META_FILE), 'w') as f:
+		json.dump({	'parents_vcf': os.path.abspath(parents_vcf),
+				'mother': maternal_sample_name,
+				'father': paternal_sample_name,
+				'contigs': contigs_meta}, f, indent = 1)
+
+	return index_path
+
+class ParentsIndex(object):
+	'''
+	read-only access to an index built by build_parents_index
+	'''
+
+	def __init__(self, index_path):
+		with open(os.path.join(index_path, META_FILE)) as f:
+			meta = json.load(f)
+		self.index_path = index_path
+		self.mother = meta['mother']
+		self.father = meta['father']
+		self.contigs = meta['contigs']
+		self._arrays = {}
+
+	def _contig_arrays(self, chrom):
+		if chrom not in self._arrays:
+			if chrom in self.contigs:
+				prefix = os.path.join(self.index_path, self.contigs[chrom]['prefix'])
+				sites = np.load(prefix + '.sites.npy', mmap_mode = 'r')
+				alleles = np.load(prefix + '.alleles.npy', mmap_mode = 'r')
+				self._arrays[chrom] = (sites, sites['pos'], alleles)
+			else:
+				self._arrays[chrom] = None
+		return self._arrays[chrom]
+
+	def lookup(self, chrom, position):
+		'''
+		returns a list of (ref, alt, maternal_gt_code, paternal_gt_code) tuples for the
+		sites at chrom:position (1-based, as in the vcf). it's empty if there is no parental site there.
+		'''
+		arrays = self._contig_arrays(chrom)
+		if arrays is None:
+			return []
+		sites, positions, alleles = arrays
+		position = int(position)
+		first = np.searchsorted(positions, position, side = 'left')
+		last = np.searchsorted(positions, position, side = 'right')
+
+		result = []
+		for site in sites[first:last]:
+			offset = site['alleles_offset']
+			ref, alt = bytes(alleles[offset:offset + site['alleles_length']]).decode().split('\t')
+			result.append((ref, alt, int(site['maternal_gt']), int(site['paternal_gt'])))
+		return result
+
+	def sites(self, chrom, start = None, end = None):
+		'''
+		yields a (position, ref, alt, maternal_gt_code, paternal_gt_code) tuple for each site of
+		chrom, in order of position. start and end are 0-based and half-open, like in pyvcf's fetch.
+		'''
+		arrays = self._contig_arrays(chrom)
+		if arrays is None:
+			return
+		sites, positions, alleles = arrays
+		first = 0 if start is None else np.searchsorted(positions, start, side = 'right')
+		last = len(positions) if end is None else np.searchsorted(positions, end, side = 'right')
+		for site in sites[first:last]:
+			offset = site['alleles_offset']
+			ref, alt = bytes(alleles[offset:offset + site['alleles_length']]).decode().split('\t')
+			yield int(site['pos']), ref, alt, int(site['maternal_gt']), int(site['paternal_gt'])
+
+	def genotypes(self, chrom, position, ref, alt):
+		'''
+		returns the maternal and paternal genotypes of the site chrom:position with these alleles,
+		as parse_gt.str_to_int would return them, or (None, None) if there is no such site.
+		'''
+		for site_ref, site_alt, maternal_gt, paternal_gt in self.lookup(chrom, position):
+			if site_ref == ref and site_alt == alt:
+				return code_to_gt(maternal_gt), code_to_gt(paternal_gt)
+		return None, None
+
+	def has_samples(self, maternal_sample_name, paternal_sample_name):
+		return (self.mother, self.father) == (maternal_sample_name, paternal_sample_name)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'build a memory-mapped index of the parental genotypes')
+	parser.add_argument("-parents_vcf", "--parents_vcf", required = True, help = 'vcf of the parents')
+	parser.add_argument("-m", "--mother", required = True, help = 'maternal sample name in the parents vcf')
+	parser.add_argument("-p", "--father", required = True, help = 'paternal sample name in the parents vcf')
+	parser.add_argument("-o", "--output", default = None, help = 'index directory. default: PARENTS_VCF.hbidx')
+	args = parser.parse_args()
+
+	print(build_parents_index(args.parents_vcf, args.mother, args.father, args.output))
@@ -0,0 +1,235 @@
+'''
+Builds hoobari's database without freebayes. Instead of parsing freebayes' debug output, like
+freebayes_patch.py, only the parental variant sites are visited, and the cfDNA reads at each site
+are taken from a pysam pileup of the cfDNA bam. Each read's allele, template length (TLEN) and
+strand, and the is_fetal and for_ff annotations of freebayes_patch.py, are written to the same
+database schema. A vcf of the sites that are covered by the cfDNA, to be passed to hoobari with
+-cfdna_vcf, is printed to stdout. Nearby sites are read with one pileup over their span, so the
+cfDNA bam is decoded about once.
+
+usage:
+
+    python /path/to/hoobari/src/pileup_ingest.py \
+    -b cfdna.sorted.mdup.bam \
+    -parents_vcf parents.vcf.gz \
+    -m mother.sorted.mdup.bam \
+    -p father.sorted.mdup.bam \
+    -t tmp_hb \
+    -r chr1:0-1000000 > cfdna.chr1_0_1000000.vcf
+
+Like freebayes' defaults, reads with mapping quality 0, duplicates, secondary and qc-failed
+reads are not used, and both reads of a pair are counted. Reads whose allele at a site isn't
+the site's REF or ALT are not used, except at snps, where the read's base is kept as its allele.
+'''
+
+import sys
+import os
+import argparse
+import pysam
+import vcf
+# project's
+import db
+import parse_gt
+from ingest import (	var_type_dic, split_region, get_var_type, add_fetal_annotations, get_parental_samples_names,
+			finish_databases)
+from parents_index import ParentsIndex
+
+VCF_HEADER = [	'##fileformat=VCFv4.2',
+		'##source=hoobari pileup_ingest.py',
+		'##INFO=<ID=DP,Number=1,Type=Integer,Description="Total read depth at the locus">',
+		'##INFO=<ID=TYPE,Number=A,Type=String,Description="The type of allele, either snp, mnp, ins, del, or complex.">',
+		'##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+		'##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read Depth">',
+		'##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Number of observation for each allele">',
+		'##FORMAT=<ID=RO,Number=1,Type=Integer,Description="Reference allele observation count">',
+		'##FORMAT=<ID=AO,Number=A,Type=Integer,Description="Alternate allele observation count">']
+
+def read_allele(pileup_read, ref, alt):
+	'''
+	returns the allele of a site that a read of the pileup column at the site's first base
+	supports: ref, alt, the read's base at snps, or None if it can't be told
+	'''
+	if pileup_read.is_del or pileup_read.is_refskip:
+		return None
+	query_position = pileup_read.query_position
+	if len(ref) == len(alt) == 1:
+		return pileup_read.alignment.query_sequence[query_position]
+	# the read's sequence over the site. an insertion or deletion right after the first base
+	# (pileup_read.indel) changes its length like it changes the length of alt
+	observed = pileup_read.alignment.query_sequence[query_position:query_position + len(ref) + pileup_read.indel]
+	if observed == ref or observed == alt:
+		return observed
+	else:
+		return None
+
+def pileup_sites(bam_reader, chrom, sites, min_mapping_quality = 1, min_base_quality = 0, max_depth = 1000000):
+	'''
+	sites - a list of (chrom, position, ref, alt, ...) tuples of one contig, sorted by position.
+	yields (site, position_list) for each site that is covered by reads, with position_list a list
+	of [allele, template length, qname, strand] lists, in the form that freebayes_patch.py builds
+	from freebayes' output. a single pileup is walked from the first site to the last, which is
+	much faster than a pileup for each site when the sites are close. nothing is yielded if chrom
+	isn't a contig of the bam, like freebayes has no records for it.
+	'''
+	if chrom not in bam_reader.references:
+		return
+	sites_at = {}
+	for site in sites:
+		sites_at.setdefault(site[1] - 1, []).append(site) # 0-based
+	for column in bam_reader.pileup(	chrom,
+						sites[0][1] - 1,
+						sites[-1][1],
+						truncate = True,
+						stepper = 'all',
+						ignore_orphans = False,
+						ignore_overlaps = False,
+						min_mapping_quality = min_mapping_quality,
+						min_base_quality = min_base_quality,
+						max_depth = max_depth):
+		if column.reference_pos not in sites_at:
+			continue
+		pileup_reads = column.pileups
+		for site in sites_at[column.reference_pos]:
+			ref, alt = site[2:4]
+			position_list = []
+			for pileup_read in pileup_reads:
+				allele = read_allele(pileup_read, ref, alt)
+				if allele is not None:
+					alignment = pileup_read.alignment
+					position_list.append([allele, abs(alignment.template_length), alignment.query_name, 0 if alignment.is_reverse else 1])
+			if position_list:
+				yield site, position_list
+
+def site_clusters(sites, max_gap = 1000):
+	'''
+	groups sites, which are sorted by contig and position, into lists of consecutive sites of
+	the same contig that are at most max_gap bp apart
+	'''
+	cluster = []
+	for site in sites:
+		if cluster and (site[0] != cluster[-1][0] or site[1] - cluster[-1][1] > max_gap):
+			yield cluster
+			cluster = []
+		cluster.append(site)
+	if cluster:
+		yield cluster
+
+def parental_sites(parents, parental_samples, region = None):
+	'''
+	yields (chrom, position, ref, alt, maternal_gt, paternal_gt) for the parental sites in the
+	region, or in the whole vcf. parents is a ParentsIndex or a vcf.Reader. the genotypes are
+	strings, like the ones that freebayes_patch.py looks up.
+	'''
+	chrom, start, end = split_region(region) if region else (None, None, None)
+	if isinstance(parents, ParentsIndex):
+		for site_chrom in ([chrom] if chrom else parents.contigs):
+			for position, ref, alt, maternal_gt, paternal_gt in parents.sites(site_chrom, start, end):
+				yield site_chrom, position, ref, alt, parse_gt.int_to_str(maternal_gt), parse_gt.int_to_str(paternal_gt)
+	else:
+		maternal_sample_name, paternal_sample_name = parental_samples
+		for rec in (parents.fetch(chrom, start, end) if chrom else parents):
+			yield (	rec.CHROM,
+				rec.POS,
+				rec.REF,
+				','.join(str(a) for a in rec.ALT),
+				rec.genotype(maternal_sample_name).data.GT,
+				rec.genotype(paternal_sample_name).data.GT)
+
+def print_vcf_header(bam_reader, cfdna_sample_name, out = sys.stdout):
+	for line in VCF_HEADER:
+		print(line, file = out)
+	for contig in bam_reader.header['SQ']:
+		print('##contig=<ID=' + contig['SN'] + ',length=' + str(contig['LN']) + '>', file = out)
+	print('#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT', cfdna_sample_name, sep = '\t', file = out)
+
+def is_supported_site(site):
+	chrom, position, ref, alt, maternal_gt, paternal_gt = site
+	return not (maternal_gt is None and paternal_gt is None) and len(alt.split(',')) == 1
+
+def ingest_sites(bam_reader, sites, vardbs, out = sys.stdout, min_mapping_quality = 1, min_base_quality = 0, max_gap = 1000):
+	'''
+	inserts the reads of each site into the databases and prints its vcf record.
+	sites that are at most max_gap bp apart share a pileup.
+	returns the number of supported sites (with a parental genotype and one alt allele), and the
+	number of them that were covered and inserted.
+	'''
+	n_sites = n_inserted = 0
+	missing_contigs = set()
+	supported_sites = (site for site in sites if is_supported_site(site))
+	for cluster in site_clusters(supported_sites, max_gap = max_gap):
+		n_sites += len(cluster)
+		if cluster[0][0] not in bam_reader.references and cluster[0][0] not in missing_contigs:
+			print(cluster[0][0], 'is not a contig of the cfDNA bam, its sites are skipped', file = sys.stderr)
+			missing_contigs.add(cluster[0][0])
+		# like freebayes, sites that aren't covered by the cfDNA are skipped
+		for site, position_list in pileup_sites(	bam_reader,
+								cluster[0][0],
+								cluster,
+								min_mapping_quality = min_mapping_quality,
+								min_base_quality = min_base_quality):
+			chrom, position, ref, alt, maternal_gt, paternal_gt = site
+
+			var_type_string = get_var_type(ref, alt)
+			ref_count = sum(1 for l in position_list if l[0] == ref)
+			alt_count = sum(1 for l in position_list if l[0] == alt)
+			print(	chrom, position, '.', ref, alt, '.', '.',
+				'DP=' + str(len(position_list)) + ';TYPE=' + var_type_string,
+				'GT:DP:AD:RO:AO',
+				':'.join(['./.', str(len(position_list)), str(ref_count) + ',' + str(alt_count), str(ref_count), str(alt_count)]),
+				sep = '\t', file = out)
+
+			add_fetal_annotations(position_list, maternal_gt, paternal_gt, ref, alt, var_type_dic[var_type_string])
+			for vardb in vardbs:
+				vardb.insertVariant(chrom.replace('chr',''), int(position), position_list)
+			n_inserted += 1
+
+	return n_sites, n_inserted
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'builds the database of hoobari from a pileup of the cfDNA bam, without freebayes')
+	parser.add_argument("-b", "--bam_file", required = True, help = 'The maternal cfDNA bam file\'s path')
+	parser.add_argument("-t", "--tmp_dir", default = 'tmp_hb')
+	parser.add_argument("-r", "--region", default = False, help = 'chrN or chrN:start-end (0-based, end excluded, like freebayes regions)')
+	parser.add_argument("-parents_vcf", "--parents_vcf", help = 'bgzipped vcf of parents, indexed by tabix')
+	parser.add_argument("-parents_index", "--parents_index", default = False, help = 'index of the parents vcf, made by parents_index.py. if given, it is used instead of -parents_vcf')
+	parser.add_argument("-m", "--m_bam", required = True, help = 'maternal bam file')
+	parser.add_argument("-p", "--p_bam", required = True, help = 'paternal bam file')
+	parser.add_argument("-db", "--db", default = 'hoobari', help = 'db name, or db prefix if hoobari is run per region')
+	parser.add_argument("-origin", "--origin", action = 'store_true', help = 'use this if hoobari will be run with -model origin')
+	parser.add_argument("--backend", choices = ['sqlite', 'columnar'], default = 'sqlite', help = 'storage of the db, see freebayes_patch.py')
+	parser.add_argument("--qnames", action = 'store_true', help = 'also keep the read names of the fragments in the db')
+	parser.add_argument("-B", "--batch_size", type = int, default = 1000, help = 'number of positions written to the db in each transaction')
+	parser.add_argument("-q", "--min_mapping_quality", type = int, default = 1, help = 'default: 1, as in freebayes')
+	parser.add_argument("-Q", "--min_base_quality", type = int, default = 0, help = 'default: 0, as in freebayes')
+	parser.add_argument("--max_gap", type = int, default = 1000, help = '''sites at most this many bp apart are read with a single pileup, instead of a
+						pileup per site. default: 1000''')
+	args = parser.parse_args()
+
+	if not (args.parents_vcf or args.parents_index):
+		sys.exit('a parents vcf (-parents_vcf) or a parents index (-parents_index) is required')
+
+	bam_reader = pysam.AlignmentFile(args.bam_file, 'rb')
+	db_name = (str(args.region) if args.region else args.db) + '.db'
+	vardb = db.open_db(os.path.join(args.tmp_dir, db_name), backend = args.backend, bulk = True, batch_size = args.batch_size, qnames = args.qnames)
+
+	parents_sample_names = get_parental_samples_names(args.m_bam, args.p_bam)
+	if args.parents_index:
+		parents = ParentsIndex(args.parents_index)
+		if not parents.has_samples(*parents_sample_names):
+			sys.exit('the parents index was built for samples ' + parents.mother + ', ' + parents.father)
+	else:
+		parents = vcf.Reader(filename = args.parents_vcf)
+	vardb.create_samples_table(parents_sample_names)
+
+	print_vcf_header(bam_reader, bam_reader.header['RG'][0]['SM'])
+	n_sites, n_inserted = ingest_sites(	bam_reader,
+						parental_sites(parents, parents_sample_names, args.region),
+						[vardb],
+						min_mapping_quality = args.min_mapping_quality,
+						min_base_quality = args.min_base_quality,
+						max_gap = args.max_gap)
+	finish_databases([vardb], origin = args.origin)
+	bam_reader.close()
+
+	print(n_inserted, 'of', n_sites, 'parental sites were covered by the cfDNA', file = sys.stderr)
+	print('finished successfully', file = sys.stderr)
@@ -1,22 +1,20 @@
 # --------- import modules ------------
 # external
 import os
-import requests
 import numpy as np
-import time
-import argparse
-from multiprocessing import Pool, cpu_count
-import ctypes
-from decimal import *
 # project's
 import parse_gt
 from stderr import *
 import vcfuid
+from db import reservoir_sample, position_seed
 
 # --------- global -------------
 de_novo = 1.2e-8
 valid_gts = (0,1,2)
-default_decimal_prec = getcontext().prec
+# number of positions called together by call_genotypes
+block_size = 1000
+# number of positions whose rows calculate_likelihoods subsampled itself (see db.RegionVariants.n_capped for prefetched rows)
+n_capped = 0
 
 # --------- functions ----------
 def calculate_priors(maternal_gt, paternal_gt):
@@ -100,12 +98,54 @@ def calculate_fragment_i(frag_genotype, maternal_gt, ref, alt, p_fet, err_rate):
 
 	return frag_i_likelihoods
 
+def fragments_log_likelihoods(
+	genotypes,
+	lengths,
+	is_fetal,
+	maternal_gt,
+	ref,
+	alt,
+	total_fetal_fraction,
+	fetal_fractions,
+	err_rate,
+	model):
+
+	'''
+	the vectorized form of calculate_fragment_i, for all the fragments of a position at once.
+	genotypes, lengths and is_fetal are arrays of the fragments' alleles, lengths (already corrected
+	for the variant's length) and is_fetal flags. returns a (fragments x 3) array of the log-likelihoods
+	of the fetal genotypes 0/0, 0/1 and 1/1, with the same values calculate_fragment_i gives.
+	fetal_fractions is the fetal fraction per length of preprocessing.fetal_fractions_lookup
+	'''
+
+	# get fetal fraction
+	if model in ('lengths', 'origin'):
+		# lengths beyond the array get its last element, the total fetal fraction
+		p_fet = fetal_fractions[np.minimum(lengths, len(fetal_fractions) - 1)]
+	else:
+		p_fet = np.full(len(lengths), total_fetal_fraction, dtype = np.float64)
+	if model == 'origin':
+		p_fet[is_fetal == 1] = 1 - err_rate
+
+	p_maternal_alt = max(err_rate, maternal_gt / 2)
+	p_maternal_ref = max(err_rate, 1 - (maternal_gt / 2))
+	is_alt = genotypes == alt
+	is_ref = (genotypes == ref) & ~is_alt
+	# the terms of calculate_fragment_i, with 1 for fragments of other alleles
+	p_fetal_allele = np.ones((len(lengths), 3), dtype = np.float64)
+	p_fetal_allele[is_ref] = (1, 0.5, 0)
+	p_fetal_allele[is_alt] = (0, 0.5, 1)
+	p_maternal = np.where(is_alt, p_maternal_alt, p_maternal_ref)[:, None]
+	p_fet = p_fet[:, None]
+	frag_likelihoods = np.where((is_alt | is_ref)[:, None], p_fetal_allele * p_fet + p_maternal * (1 - p_fet), 1)
+
+	return np.log(frag_likelihoods, dtype = np.float64)
+
 def calculate_likelihoods(
 	rec,
-	cfdna_bam_reader,
 	maternal_gt,
 	total_fetal_fraction,
-	fetal_fractions_df,
+	fetal_fractions,
 	err_rate,
 	vardb,
 	model,
@@ -118,48 +158,46 @@ def calculate_likelihoods(
 	the model, such as the maternal genotype, fragment length and the fetal genotype (which is unknown,
 	so we check for all possibilities - 1/1, 0/1 and 0/0)
 	'''
+	global n_capped
 
 	chrom, pos, ref, alt = rec.CHROM.replace('chr', ''), str(rec.POS), rec.REF, str(rec.ALT[0])
 
 	variant_len = len(ref) - len(alt)
 
 	printverbose(chrom, pos)
-	pos_data = vardb.getPositionVariants(chrom, pos, model).fetchall()
+	# the rows of the position, if the caller prefetched them (see db.RegionVariants)
+	pos_data = kwargs.get('pos_data')
+	if pos_data is None:
+		pos_data = vardb.getPositionVariants(chrom, pos, model)
+		# with more than max_depth rows, a sample of max_depth of them, read from the cursor
+		if max_depth:
+			pos_data, capped = reservoir_sample(pos_data, int(max_depth), position_seed(kwargs.get('seed', 0), chrom, pos))
+			if capped:
+				n_capped += 1
+		else:
+			pos_data = pos_data.fetchall()
 	printverbose('position_data:')
 	printverbose(pos_data)
 
-	first = 1
 	if (len(pos_data) > 0) and (maternal_gt in valid_gts):
 
-		for frag_genotype, frag_length, frag_is_fetal in pos_data:
-
-			# if variant_len > 0: # deletion ####
-			frag_length = max(int(frag_length) - variant_len, 0)
-
-			# get fetal fraction
-			if (model == 'origin') and (frag_is_fetal == 1):
-				printverbose('fragment was marked as fetal by another variant')
-				p_fetal = 1 - err_rate
-			elif (model in ('lengths', 'origin')) and (frag_length in fetal_fractions_df.index.values):
-				p_fetal = fetal_fractions_df[frag_length]
-			else:
-				p_fetal = total_fetal_fraction
-
-			frag_i_likelihoods = calculate_fragment_i(frag_genotype,
-								maternal_gt,
-								ref,
-								alt,
-								p_fetal,
-								err_rate)
-
-			#frag_i_likelihoods[frag_i_likelihoods == 0] = 0.003
-			frag_i_likelihoods = np.log(frag_i_likelihoods, dtype = np.float64)
-			if first:
-				sum_log_fragments_likelihoods_df = frag_i_likelihoods
-				first = 0
-			else:
-				sum_log_fragments_likelihoods_df = np.add(sum_log_fragments_likelihoods_df, frag_i_likelihoods)
-			printverbose(p_fetal, frag_i_likelihoods, sum_log_fragments_likelihoods_df, sep = '\t')
+		genotypes, lengths, is_fetal = zip(*pos_data)
+		# if variant_len > 0: # deletion ####
+		lengths = np.maximum(np.array(lengths, dtype = np.int64) - variant_len, 0)
+		frag_log_likelihoods = fragments_log_likelihoods(	np.array(genotypes, dtype = object),
+									lengths,
+									np.array(is_fetal),
+									maternal_gt,
+									ref,
+									alt,
+									total_fetal_fraction,
+									fetal_fractions,
+									err_rate,
+									model)
+		printverbose(frag_log_likelihoods)
+
+		# summed in the order of the fragments, like a running sum
+		sum_log_fragments_likelihoods_df = np.cumsum(frag_log_likelihoods, axis = 0)[-1]
 
 	else:
 		sum_log_fragments_likelihoods_df = np.log([1, 1, 1], dtype = np.float64)
@@ -167,26 +205,33 @@ def calculate_likelihoods(
 
 	return sum_log_fragments_likelihoods_df
 
-def calculate_phred(joint_probabilities):
-	libphred = np.ctypeslib.load_library('libphred.so','/groups/nshomron/tomr/projects/cffdna/hoobari/src/') #TODO - fix to relative path
-	libphred.calculatePhred.restype = ctypes.c_longdouble
-	cdubs = joint_probabilities.ctypes.data_as(ctypes.POINTER(ctypes.c_longdouble))
+def log_sum_exp(a, axis = -1):
+	'''
+	log(sum(exp(a))) along axis, with the largest element factored out of the sum, so that exp
+	never overflows. -inf if all the elements are -inf.
+	'''
+	a_max = np.max(a, axis = axis, keepdims = True)
+	a_max[~np.isfinite(a_max)] = 0
+	with np.errstate(divide = 'ignore'):
+		return np.log(np.sum(np.exp(a - a_max), axis = axis)) + np.squeeze(a_max, axis = axis)
 
-	return libphred.calculatePhred(cdubs)
+def qual_value(log_posteriors):
+	'''
+	QUAL, the phred-scaled posterior probability of the fetal genotype 0/0, from the log of the
+	posteriors (of a position, or a (positions x 3) array). np.inf if the probability is 0.
+	'''
+	return -10 * log_posteriors[..., 0] / np.log(10)
 
-def simple_qual_calculation(posteriors):
+def format_qual(qual):
 
-	if posteriors[0] == 0:
+	if qual == np.inf:
 		return '1e+06'
+	elif qual == 0:
+		return int(0)
+	elif qual < 1:
+		return '{:0.3e}'.format(qual)
 	else:
-		qual = -10 * np.log10(posteriors[0])
-
-		if qual == 0:
-			return int(0)
-		elif qual < 1:
-			return '{:0.3e}'.format(qual)
-		else:
-			return round(qual,2)
+		return round(qual,2)
 
 def likelihoods_to_phred_scale(likelihoods):
 
@@ -198,6 +243,16 @@ def likelihoods_to_phred_scale(likelihoods):
 
 	return phred_scaled_normalized_likelihoods
 
+def calculate_log_posteriors(var_priors, var_likelihoods):
+	'''
+	the joint probabilities (log(priors) + log-likelihoods) and the log of the posteriors, normalized
+	in log space with log_sum_exp, of a position, or of (positions x 3) arrays of priors and likelihoods.
+	'''
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		joint_probabilities = np.add(np.log(var_priors), var_likelihoods, dtype = np.float64)
+		log_posteriors = joint_probabilities - log_sum_exp(joint_probabilities)[..., None]
+	return (joint_probabilities, log_posteriors)
+
 def calculate_posteriors(var_priors, var_likelihoods):
 
 	printverbose(var_priors, var_likelihoods, sep = '\n')
@@ -209,35 +264,43 @@ def calculate_posteriors(var_priors, var_likelihoods):
 	# parents genotypes might give a prediction but if it's not supported by cfdna it's only indirect - good or not? not for de-novo...
 	# it is good for recessive disease!
 
-	var_priors = np.log(var_priors)
-	printverbose('log(priors):', var_priors)
-
-	joint_probabilities = np.add(var_priors, var_likelihoods, dtype = np.float64)
+	joint_probabilities, log_posteriors = calculate_log_posteriors(var_priors, var_likelihoods)
+	printverbose('joint_probabilities:', joint_probabilities)
 	prediction = joint_probabilities.argmax()
+	posteriors = np.exp(log_posteriors)
 
-	joint_probabilities_normalized = joint_probabilities - np.min(joint_probabilities[np.isfinite(joint_probabilities)])
-	exp_joint_probabilities = np.exp(joint_probabilities_normalized)
-	printverbose('joint_probabilities_normalized:', joint_probabilities_normalized)
-	posteriors = np.asarray((exp_joint_probabilities / np.sum(exp_joint_probabilities)), dtype = np.float64)
-	printverbose('posteriors:', posteriors)
-	if np.inf in exp_joint_probabilities:
-		getcontext().prec = default_decimal_prec
-		start_time = time.time()
-		while 1 or np.nan in posteriors:
-			if getcontext().prec <= 2**11:
-				printverbose('precision:', str(getcontext().prec))
-				exp_joint_probabilities = np.array([Decimal(i).exp() for i in joint_probabilities_normalized])
-				posteriors = np.array(exp_joint_probabilities / np.sum(exp_joint_probabilities))
-				printverbose('posteriors:', posteriors)
-				getcontext().prec *= 2
-			else:
-				break
-		printverbose(time.time() - start_time)
-
-	qual = simple_qual_calculation(posteriors)
+	qual = format_qual(qual_value(log_posteriors))
 
 	printverbose('Posteriors:', posteriors)
 	printverbose('Predicted genotype:', prediction)
 	printverbose('QUAL:', qual)
 
 	return (posteriors, prediction, qual)
+
+def call_genotypes(priors, likelihoods):
+
+	'''
+	the calculations of calculate_posteriors and likelihoods_to_phred_scale, for a block of positions at once.
+	priors and likelihoods are lists of the calculate_priors and calculate_likelihoods of the positions,
+	that are stacked into (positions x 3) arrays. returns arrays of the predicted genotypes and of the
+	QUALs (qual_value, to be formatted with format_qual), and the (positions x 3) arrays of the
+	normalized phred-scaled likelihoods (GL), priors (PG) and posteriors (PP).
+	'''
+
+	priors = np.array(priors, dtype = np.float64).reshape(-1, 3)
+	likelihoods = np.array(likelihoods, dtype = np.float64).reshape(-1, 3)
+	printverbose('priors:', priors, 'likelihoods:', likelihoods, sep = '\n')
+
+	joint_probabilities, log_posteriors = calculate_log_posteriors(priors, likelihoods)
+	predictions = joint_probabilities.argmax(axis = 1)
+	posteriors = np.exp(log_posteriors)
+	quals = qual_value(log_posteriors)
+
+	with np.errstate(invalid = 'ignore'):
+		log10_likelihoods = likelihoods / np.log(10)
+		normalized_likelihoods = -10 * (log10_likelihoods - log10_likelihoods.max(axis = 1)[:, None])
+		normalized_likelihoods[normalized_likelihoods == -0.0] = 0
+
+	printverbose('posteriors:', posteriors, 'predictions:', predictions, 'QUAL:', quals, sep = '\n')
+
+	return (predictions, quals, normalized_likelihoods, priors, posteriors)
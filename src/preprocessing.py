@@ -1,48 +1,138 @@
 # --------- import modules ------------
 # external
 import os, sys
-import sqlite3
-import vcf
-from collections import Counter
+import json
+import hashlib
+import shutil
+import tempfile
 from numpy import repeat as nprepeat
-import pandas as pd
 import numpy as np
-import matplotlib
-matplotlib.use('Agg') # to allow saving a figure even though display is invalid
-import matplotlib.pyplot as plt
-import seaborn as sns
-from multiprocessing import Pool, cpu_count
+from collections import Counter
+from multiprocessing import Pool
 from functools import partial
 
 # project's
-import parse_gt
 from stderr import *
-import vcfuid
 import db
+from fragment_store import is_fragment_store
+from external_sort import SortedRuns, merge_runs
+
+
+# version of the files of save_preprocessing
+PREPROCESSING_FORMAT = 2
+
+# size of the length count arrays of aggregate_length_counts. the few longer fragments are counted
+# in a Counter next to each array
+LENGTH_COUNTS_SIZE = 2**15
 
+# normalized fetal fraction per length, of family G1 (see estimate_length_distribution)
+default_prior_fetal_fractions = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'prior_fetal_fractions.tsv')
+_prior_fetal_fractions = {}
 
 # --------- functions ----------
 
-def get_fetal_and_shared_lengths(db_path, qnames = False):
+def is_merged_db(db_entry, known_dbs = None):
 	'''
-	input - path to the database from hoobari's patch
-	output - a tuple with two dictionaries, one contains the counts of fetal fragments at different lengths,
-	and the other is similar, but for fragments which aren't necessarily fetal ("shared")
+	db.is_merged_db of a database file of os.scandir, which opens the database, unless known_dbs
+	(path -> [size, mtime_ns, is_merged], as save_preprocessing keeps it) has the database with the
+	same size and modification time. known_dbs is updated with the answer.
 	'''
-	
-	con = db.Variants(db_path, probe=False)
-	
-	fetal_lengths = con.getFetalLengths()
-	shared_lengths = con.getSharedLengths()
+	if known_dbs is None or db_entry.is_dir():
+		return db.is_merged_db(db_entry.path)
+	stat = db_entry.stat()
+	stamp = [stat.st_size, stat.st_mtime_ns]
+	known = known_dbs.get(db_entry.path)
+	if known is None or known[:2] != stamp:
+		known = known_dbs[db_entry.path] = stamp + [db.is_merged_db(db_entry.path)]
+	return known[2]
+
+def get_db_files(db_path, region = False, known_dbs = None):
+	'''
+	the paths of the databases to pre-process: db_path, if it's a database, or the per-region
+	databases in it, if it's a directory and hoobari is run on a region. known_dbs - see is_merged_db,
+	so that region jobs don't open every database of the directory
+	'''
+	db_path = os.path.abspath(db_path)
+	if os.path.isfile(db_path) or is_fragment_store(db_path):
+		db_files = [db_path]
+	elif os.path.isdir(db_path):
+		if region:
+			db_entries = [entry for entry in os.scandir(db_path) if entry.name.endswith('.db')]
+			if known_dbs is not None:
+				for known_db in set(known_dbs) - set(entry.path for entry in db_entries):
+					del known_dbs[known_db]
+			# a database merged from the region databases (scripts/hoobari-merge-db) would count them twice
+			db_files = [entry.path for entry in db_entries if not is_merged_db(entry, known_dbs)]
+			if not db_files:
+				sys.exit('no region databases (.db files) were found in ' + db_path)
+		else:
+			sys.exit('If no database file is specified, a region must be specified using hoobari -r chrN:NNN-NNN')		
+	else:
+		sys.exit('Please specify a database file or the dir or  using hoobari -d LOCATION \
+			a region using hoobari -r chrN:NNN-NNN')
+	return db_files
 
-	if qnames:
-		fetal_qnames, shared_qnames = con.getFetalSharedQnames()
-		return (shared_lengths, fetal_lengths, shared_qnames, fetal_qnames)
+def aggregate_length_counts(db_files, spill_dir = None):
+	'''
+	the map step of create_length_distributions: sums the shared and fetal length counts of the
+	databases into two arrays of LENGTH_COUNTS_SIZE lengths, and the counts of the lengths beyond
+	them into two Counters. if spill_dir is given, the shared and fetal qnames of the databases
+	are streamed into sorted runs (external_sort.SortedRuns) in it.
+	returns (shared_counts, fetal_counts, shared_qnames_runs, fetal_qnames_runs, shared_long_counts, fetal_long_counts)
+	'''
+	shared_counts = np.zeros(LENGTH_COUNTS_SIZE, dtype = np.int64)
+	fetal_counts = np.zeros(LENGTH_COUNTS_SIZE, dtype = np.int64)
+	shared_long_counts, fetal_long_counts = Counter(), Counter()
+	if spill_dir:
+		shared_qnames_runs, fetal_qnames_runs = SortedRuns(spill_dir), SortedRuns(spill_dir)
+	for db_file in db_files:
+		con = db.open_db(db_file, probe=False, read_only=True)
+		try:
+			shared_lengths = con.getSharedLengths()
+			fetal_lengths = con.getFetalLengths()
+		except:
+			sys.exit(str(db_file))
+		for counts, long_counts, lengths in (	(shared_counts, shared_long_counts, shared_lengths),
+							(fetal_counts, fetal_long_counts, fetal_lengths)):
+			length_values = lengths.index.values.astype(np.int64)
+			length_counts = lengths.iloc[:, 0].values.astype(np.int64)
+			in_array = (length_values >= 0) & (length_values < LENGTH_COUNTS_SIZE)
+			np.add.at(counts, length_values[in_array], length_counts[in_array])
+			long_counts.update(dict(zip(length_values[~in_array].tolist(), length_counts[~in_array].tolist())))
+		if spill_dir:
+			if not con.hasReadNames():
+				printerr(db_file, 'has no read names (see the --qnames option of freebayes_patch.py), writing fragment ids instead')
+			shared_qnames_runs.update(str(q) for q in con.iterQnames('shared'))
+			fetal_qnames_runs.update(str(q) for q in con.iterQnames('fetal'))
+
+	if spill_dir:
+		return (shared_counts, fetal_counts, shared_qnames_runs.flush(), fetal_qnames_runs.flush(), shared_long_counts, fetal_long_counts)
 	else:
-		return (shared_lengths, fetal_lengths)
+		return (shared_counts, fetal_counts, [], [], shared_long_counts, fetal_long_counts)
 
+def tree_sum(arrays):
+	'''
+	the reduce step of create_length_distributions: adds up a non-empty list of arrays in pairs, level by level
+	'''
+	while len(arrays) > 1:
+		arrays = [arrays[i] + arrays[i + 1] if i + 1 < len(arrays) else arrays[i] for i in range(0, len(arrays), 2)]
+	return arrays[0]
 
-def create_length_distributions(db_path, cores, qnames = False, region = False):
+def length_counts_to_df(counts, long_counts = None):
+	'''
+	a count array of aggregate_length_counts, and its Counter of longer lengths, as a length
+	distribution dataframe, like the ones of db.Variants.getSharedLengths / getFetalLengths
+	'''
+	# pandas is only imported when the length distributions are made, it takes a while to import
+	import pandas as pd
+	long_counts = long_counts or {}
+	length_values = np.flatnonzero(counts)
+	long_lengths = sorted(long_counts)
+	return pd.DataFrame({	'length': np.concatenate((length_values, np.array(long_lengths, dtype = np.int64))),
+				'COUNT(length)': np.concatenate((counts[length_values], np.array([long_counts[l] for l in long_lengths], dtype = np.int64)))}
+				).set_index('length').sort_index()
+
+def create_length_distributions(db_path, cores, qnames = False, region = False, gzip_qnames = False, known_dbs = None):
 	'''
 	input: db_path - path to the database from hoobari's patch; cores - number of cores to use for
 	multiprocessing; db_prefix - if hoobari's patch was ran for many different regions, it creates
@@ -50,75 +140,43 @@ def create_length_distributions(db_path, cores, qnames = False, region = False):
 	is also required.
 	output: a tuple with two pandas dataframes that contain fragment length distributions which were
 	calculated using *all* the databases
+	with qnames, the sorted shared and fetal qnames of all the databases are written to
+	shared_qnames_list.txt and fetal_qnames_list.txt (.txt.gz if gzip_qnames)
+	known_dbs - see is_merged_db
 	'''
 
-	# if the number of cores was specified - use it. if not, and there's more than 1 core, use all cores
-	# except for one.
-	# if cores:
-	# 	pool = Pool(int(cores))
-	# else:
-	# 	if cpu_count() > 1:
-	# 		pool = Pool(cpu_count() - 1)
-	# 	else:
-	# 		pool = Pool(1)
-	pool = Pool(int(cores))
-
-	db_path = os.path.abspath(db_path)
-	if os.path.isfile(db_path):
-		db_files = [db_path]
-	elif os.path.isdir(db_path):
-		if region:
-			db_files_loc = db_path
-			db_files = [os.path.join(db_files_loc, f) for f in os.listdir(db_files_loc) if f.endswith('.db')]
-		else:
-			sys.exit('If no database file is specified, a region must be specified using hoobari -r chrN:NNN-NNN')		
-	else:
-		sys.exit('Please specify a database file or the dir or  using hoobari -d LOCATION \
-			a region using hoobari -r chrN:NNN-NNN')
-
-	# run the function get_fetal_and_shared_lengths for each path in db_files
-	# pooled_results = pool.map(get_fetal_and_shared_lengths, db_files)
-	get_qnames_and_alleles_with_args = partial(get_fetal_and_shared_lengths, qnames = qnames)
-	# pooled_results = pool.map(get_qnames_and_alleles_with_args, db_files) #TODO: use pool.imap_unordered(func, iterable[, chunksize])
-	# pool.close()
-	# pool.join()
+	db_files = get_db_files(db_path, region, known_dbs)
 
-	# create two lists, one with all the shared fragments results, and one for the fetal fragments results
-	
-	con = db.Variants(db_files[0], probe=False)
+	# each task aggregates a chunk of the databases into count arrays, and spills its qnames to
+	# sorted runs, so that only small arrays and file names are sent back to this process. the runs
+	# are then merged into the sorted lists of qnames, with a bounded memory
+	n_tasks = min(len(db_files), int(cores) * 4)
+	chunks = [db_files[i::n_tasks] for i in range(n_tasks)]
+	spill_dir = tempfile.mkdtemp(prefix = 'hoobari_qnames_', dir = '.') if qnames else None
 	try:
-		shared_lengths = con.getSharedLengths()
-		fetal_lengths = con.getFetalLengths()
-	except:
-		sys.exit(str(db_path))
+		aggregate_chunk = partial(aggregate_length_counts, spill_dir = spill_dir)
+		if len(chunks) == 1:
+			partial_results = [aggregate_chunk(chunks[0])]
+		else:
+			with Pool(int(cores)) as pool:
+				partial_results = list(pool.imap_unordered(aggregate_chunk, chunks))
 
-	if qnames:
-		fetal_qnames_set, shared_qnames_set = con.getFetalSharedQnames()
+		shared_counts = tree_sum([result[0] for result in partial_results])
+		fetal_counts = tree_sum([result[1] for result in partial_results])
 
-	for tup in pool.imap_unordered(get_qnames_and_alleles_with_args, db_files[1:], 100):
-		shared_lengths = shared_lengths.add(tup[0], fill_value=0)
-		fetal_lengths = fetal_lengths.add(tup[1], fill_value=0)
 		if qnames:
-			fetal_qnames_set.update(tup[3])
-			shared_qnames_set.update(tup[2])
-			
-
-	# for db_path in db_files[1:]:
-	# 	con = db.Variants(db_path, probe=False)
-	# 	shared_lengths = shared_lengths.add(con.getSharedLengths(), fill_value=0)
-	# 	fetal_lengths = fetal_lengths.add(con.getFetalLengths(), fill_value=0)
-	# 	if qnames:
-	# 		tup = con.getFetalSharedQnames()
-	# 		shared_qnames_set.update(tup[1])
-	# 		fetal_qnames_set.update(tup[0])
-
-	if qnames:
-		with open('shared_qnames_list.txt', 'w') as f:
-			for q in shared_qnames_set:
-				print(q, file = f)
-		with open('fetal_qnames_list.txt', 'w') as f:
-			for q in fetal_qnames_set:
-				print(q, file = f)
+			extension = '.txt.gz' if gzip_qnames else '.txt'
+			for name, i in (('shared', 2), ('fetal', 3)):
+				merge_runs(	[path for result in partial_results for path in result[i]],
+						name + '_qnames_list' + extension,
+						spill_dir,
+						compress = gzip_qnames)
+	finally:
+		if spill_dir:
+			shutil.rmtree(spill_dir)
+
+	shared_lengths = length_counts_to_df(shared_counts, sum((result[4] for result in partial_results), Counter()))
+	fetal_lengths = length_counts_to_df(fetal_counts, sum((result[5] for result in partial_results), Counter()))
 
 	# with pd.option_context('display.max_rows', None):
 	# pulled_lengths = shared_lengths.add(fetal_lengths, fill_value=0)
@@ -145,15 +203,30 @@ def create_length_distributions(db_path, cores, qnames = False, region = False):
 
 	return(shared_lengths, fetal_lengths)
 
+def load_prior_fetal_fractions(path = default_prior_fetal_fractions):
+	'''
+	returns the normalized fetal fraction per fragment length (the fetal fraction of each length
+	divided by the total fetal fraction), used as a prior when there are no fetal fragments to
+	estimate it from. it is read once, and kept for the next calls
+	'''
+	if path not in _prior_fetal_fractions:
+		_prior_fetal_fractions[path] = np.loadtxt(path, skiprows = 1, usecols = 1)
+	return _prior_fetal_fractions[path]
+
 def estimate_length_distribution(total_fetal_fraction):
-	normalized_fetal_fractions_dist = pd.Series([1.195695703013115, 1.195695703013115, 1.195695703013115, 1.195695703013115, 2.1292505317701584, 2.1292505317701584, 2.1292505317701584, 2.266846530994138, 2.266846530994138, 2.266846530994138, 1.500350157313987, 1.500350157313987, 1.500350157313987, 1.4017112196359047, 1.4017112196359047, 1.4017112196359047, 2.1773657468759486, 2.1773657468759486, 2.1773657468759486, 1.2377350652159864, 1.2377350652159864, 1.2377350652159864, 1.5465401566595522, 1.5465401566595522, 1.5465401566595522, 2.4365123449703865, 2.4365123449703865, 2.4365123449703865, 1.4853524240997755, 1.4853524240997755, 1.4853524240997755, 1.3845453630979483, 1.3845453630979483, 1.3845453630979483, 1.502413694347957, 1.502413694347957, 1.502413694347957, 1.4704651566050584, 1.4704651566050584, 1.4704651566050584, 1.3658814263443844, 1.3658814263443844, 1.3658814263443844, 1.3763656011350447, 1.3763656011350447, 1.3763656011350447, 1.4051395839047558, 1.4051395839047558, 1.4051395839047558, 1.418233691511955, 1.418233691511955, 1.418233691511955, 1.3090329283666646, 1.3090329283666646, 1.3090329283666646, 1.431968780624545, 1.431968780624545, 1.431968780624545, 1.5523974278336532, 1.5523974278336532, 1.5523974278336532, 1.5055667413383695, 1.5055667413383695, 1.5055667413383695, 1.5402599292330517, 1.5402599292330517, 1.5402599292330517, 1.6017058738173935, 1.6017058738173935, 1.6017058738173935, 1.8423934249381364, 1.8423934249381364, 1.8423934249381364, 1.5959188109726787, 1.5959188109726787, 1.5959188109726787, 1.6819447781494345, 1.6819447781494345, 1.6819447781494345, 1.838203977414241, 1.838203977414241, 1.838203977414241, 1.7224392310333196, 1.7224392310333196, 1.7224392310333196, 1.7289746387048759, 1.7289746387048759, 1.7289746387048759, 1.9095170280669445, 1.9095170280669445, 1.9095170280669445, 2.072064953768226, 2.072064953768226, 2.072064953768226, 2.031656551788986, 2.031656551788986, 2.031656551788986, 2.0585066571357045, 2.0585066571357045, 2.0585066571357045, 2.3809272197788394, 2.3809272197788394, 2.3809272197788394, 2.1077576575995667, 2.1077576575995667, 2.1077576575995667, 2.191545927606252, 2.191545927606252, 2.191545927606252, 2.2134804031902116, 2.2134804031902116, 2.2134804031902116, 2.265610562618742, 2.265610562618742, 2.265610562618742, 2.2168216834122103, 2.2168216834122103, 2.2168216834122103, 2.218832271923642, 2.218832271923642, 2.218832271923642, 2.2368565308945136, 2.2368565308945136, 2.2368565308945136, 2.25614804726495, 2.25614804726495, 2.25614804726495, 2.254777147721188, 2.254777147721188, 2.254777147721188, 2.174109728454312, 2.174109728454312, 2.174109728454312, 2.0921539080118357, 2.0921539080118357, 2.0921539080118357, 1.9909559873678913, 1.9909559873678913, 1.9909559873678913, 1.8062678281374691, 1.8062678281374691, 1.8062678281374691, 1.7368734604292917, 1.7368734604292917, 1.7368734604292917, 1.6218278923731848, 1.6218278923731848, 1.6218278923731848, 1.4322992178660081, 1.4322992178660081, 1.4322992178660081, 1.3352647823898771, 1.3352647823898771, 1.3352647823898771, 1.2686590417033243, 1.2686590417033243, 1.2686590417033243, 1.0927236004122058, 1.0927236004122058, 1.0927236004122058, 0.9803002372280191, 0.9803002372280191, 0.9803002372280191, 0.8427104331050591, 0.8427104331050591, 0.8427104331050591, 0.7381302643241816, 0.7381302643241816, 0.7381302643241816, 0.7075162035381661, 0.7075162035381661, 0.7075162035381661, 0.676098160742928, 0.676098160742928, 0.676098160742928, 0.6278752302805902, 0.6278752302805902, 0.6278752302805902, 0.6231931763990364, 0.6231931763990364, 0.6231931763990364, 0.63257035977172, 0.63257035977172, 0.63257035977172, 0.6139473479557893, 0.6139473479557893, 0.6139473479557893, 0.5857105932383947, 0.5857105932383947, 0.5857105932383947, 0.5881352460327547, 0.5881352460327547, 0.5881352460327547, 0.594082727260782, 0.594082727260782, 0.594082727260782, 0.586817647502322, 0.586817647502322, 0.586817647502322, 0.5698097918562272, 0.5698097918562272, 0.5698097918562272, 0.5806322325263193, 0.5806322325263193, 0.5806322325263193, 0.5904635937592888, 0.5904635937592888, 0.5904635937592888, 0.5840741907923023, 0.5840741907923023, 0.5840741907923023, 0.5840255259523812, 0.5840255259523812, 0.5840255259523812, 0.5922311565838844, 0.5922311565838844, 0.5922311565838844, 0.6064678225478712, 0.6064678225478712, 0.6064678225478712, 0.6136005641432725, 0.6136005641432725, 0.6136005641432725, 0.6244629891099108, 0.6244629891099108, 0.6244629891099108, 0.6376257216882676, 0.6376257216882676, 0.6376257216882676, 0.6542991471721685, 0.6542991471721685, 0.6542991471721685, 0.7033573442096076, 0.7033573442096076, 0.7033573442096076, 0.703911126676141, 0.703911126676141, 0.703911126676141, 0.7587414061130653, 0.7587414061130653, 0.7587414061130653, 0.8740076538936232, 0.8740076538936232, 0.8740076538936232, 0.884150425181996, 0.884150425181996, 0.884150425181996, 0.9426520776310289, 0.9426520776310289, 0.9426520776310289, 1.1282294239906596, 1.1282294239906596, 1.1282294239906596, 1.2153840648878125, 1.2153840648878125, 1.2153840648878125, 1.2079720982674649, 1.2079720982674649, 1.2079720982674649, 1.4132332099959584, 1.4132332099959584, 1.4132332099959584, 1.6230888667079653, 1.6230888667079653, 1.6230888667079653, 1.6410133756480851, 1.6410133756480851, 1.6410133756480851, 1.5881958805960414, 1.5881958805960414, 1.5881958805960414, 1.804646175017287, 1.804646175017287, 1.804646175017287, 1.8663031895199826, 1.8663031895199826, 1.8663031895199826, 1.722164272055739, 1.722164272055739, 1.722164272055739, 1.647652996618907, 1.647652996618907, 1.647652996618907, 1.6469506154771867, 1.6469506154771867, 1.6469506154771867, 1.5591307817064606, 1.5591307817064606, 1.5591307817064606, 1.4719108420425855, 1.4719108420425855, 1.4719108420425855, 1.4297892857851822, 1.4297892857851822, 1.4297892857851822, 1.2920953050015427, 1.2920953050015427, 1.2920953050015427, 1.2205711342919268, 1.2205711342919268, 1.2205711342919268, 1.1685208246563323, 1.1685208246563323, 1.1685208246563323, 1.049551130346437, 1.049551130346437, 1.049551130346437, 0.9610278990446985, 0.9610278990446985, 0.9610278990446985, 0.8977333939331735, 0.8977333939331735, 0.8977333939331735, 0.8334190606426094, 0.8334190606426094, 0.8334190606426094, 0.7648045083513764, 0.7648045083513764, 0.7648045083513764, 0.6988298101538835, 0.6988298101538835, 0.6988298101538835, 0.6585666878492391, 0.6585666878492391, 0.6585666878492391, 0.6111684996680828, 0.6111684996680828, 0.6111684996680828, 0.5665580244134178, 0.5665580244134178, 0.5665580244134178, 0.5148781211828849, 0.5148781211828849, 0.5148781211828849, 0.48618640994323403, 0.48618640994323403, 0.48618640994323403, 0.46033587532991155, 0.46033587532991155, 0.46033587532991155, 0.42457852975307236, 0.42457852975307236, 0.42457852975307236, 0.3910311549657173, 0.3910311549657173, 0.3910311549657173, 0.36425156818383675, 0.36425156818383675, 0.36425156818383675, 0.3470777453124518, 0.3470777453124518, 0.3470777453124518, 0.3297880637926003, 0.3297880637926003, 0.3297880637926003, 0.3107121988327585, 0.3107121988327585, 0.3107121988327585, 0.29652484531889745, 0.29652484531889745, 0.29652484531889745, 0.2811141469156768, 0.2811141469156768, 0.2811141469156768, 0.2667474285969589, 0.2667474285969589, 0.2667474285969589, 0.2617349980954065, 0.2617349980954065, 0.2617349980954065, 0.24441903266922857, 0.24441903266922857, 0.24441903266922857, 0.23718219453784634, 0.23718219453784634, 0.23718219453784634, 0.23607152333768355, 0.23607152333768355, 0.23607152333768355, 0.23895766208345, 0.23895766208345, 0.23895766208345, 0.23069303775657976, 0.23069303775657976, 0.23069303775657976, 0.22778154338144438, 0.22778154338144438, 0.22778154338144438, 0.22227276488421002, 0.22227276488421002, 0.22227276488421002, 0.2259470817454212, 0.2259470817454212, 0.2259470817454212, 0.2286492302134698, 0.2286492302134698, 0.2286492302134698, 0.23503432221840026, 0.23503432221840026, 0.23503432221840026, 0.23077484051921943, 0.23077484051921943, 0.23077484051921943, 0.2422018108014714, 0.2422018108014714, 0.2422018108014714, 0.2406218002553601, 0.2406218002553601, 0.2406218002553601, 0.26980269067502727, 0.26980269067502727, 0.26980269067502727, 0.2723817890491493, 0.2723817890491493, 0.2723817890491493, 0.29331623708078347, 0.29331623708078347, 0.29331623708078347, 0.33219796463591716, 0.33219796463591716, 0.33219796463591716, 0.3292209097084398, 0.3292209097084398, 0.3292209097084398, 0.39068358636774314, 0.39068358636774314, 0.39068358636774314, 0.45534117696074344, 0.45534117696074344, 0.45534117696074344, 0.49527403960628974, 0.49527403960628974, 0.49527403960628974, 0.5293983772269767, 0.5293983772269767, 0.5293983772269767, 0.5805258692936526, 0.5805258692936526, 0.5805258692936526, 0.5972556785462638, 0.5972556785462638, 0.5972556785462638, 0.6297278740840514, 0.6297278740840514, 0.6297278740840514, 0.6637066874967081, 0.6637066874967081, 0.6637066874967081, 0.7017438932271006, 0.7017438932271006, 0.7017438932271006, 0.6973996643075412, 0.6973996643075412, 0.6973996643075412, 0.6460060403539388, 0.6460060403539388, 0.6460060403539388, 0.6474303229677442, 0.6474303229677442, 0.6474303229677442, 0.6356648095891243, 0.6356648095891243, 0.6356648095891243, 0.5957781895580423, 0.5957781895580423, 0.5957781895580423, 0.5625754979314425, 0.5625754979314425, 0.5625754979314425, 0.5474479316706278, 0.5474479316706278, 0.5474479316706278, 0.5020326892714471, 0.5020326892714471, 0.5020326892714471, 0.4812812131075173, 0.4812812131075173, 0.4812812131075173, 0.4625050816019519, 0.4625050816019519, 0.4625050816019519, 0.4551534498168077, 0.4551534498168077, 0.4551534498168077, 0.41882891956888196, 0.41882891956888196, 0.41882891956888196, 0.40052291725759387, 0.40052291725759387, 0.40052291725759387, 0.3989206002929431, 0.3989206002929431, 0.3989206002929431, 0.3844624865835286, 0.3844624865835286, 0.3844624865835286, 0.3379402117997727, 0.3379402117997727, 0.3379402117997727])
-	fetal_fractions_df = total_fetal_fraction * normalized_fetal_fractions_dist
+	import pandas as pd
+	fetal_fractions_df = total_fetal_fraction * pd.Series(load_prior_fetal_fractions())
 	return(fetal_fractions_df)
 
 def generate_length_distributions_plot(shared_lengths, fetal_lengths, fetal_sample):
 	'''
 	save the length distributions plot
 	'''
+	# matplotlib is only imported when plotting, it takes a while to import
+	import matplotlib
+	matplotlib.use('Agg') # to allow saving a figure even though display is invalid
+	import matplotlib.pyplot as plt
+	import pandas as pd
 	fetal_lengths_500 = fetal_lengths[fetal_lengths.index < 501]
 	shared_lengths_500 = shared_lengths[shared_lengths.index < 501]
 	shared_density = shared_lengths_500 / shared_lengths_500.sum()
@@ -167,12 +240,27 @@ def calculate_total_fetal_fraction(shared_lengths, fetal_lengths):
 
 	# n_shared = int(shared_lengths[shared_lengths.index < 501].sum())
 	# n_fetal = int(fetal_lengths[fetal_lengths.index < 501].sum())
-	n_shared = int(shared_lengths.sum())
-	n_fetal = int(fetal_lengths.sum())
+	n_shared = int(shared_lengths.values.sum())
+	n_fetal = int(fetal_lengths.values.sum())
 	total_fetal_fraction = (2 * n_fetal) / (n_shared + n_fetal)
 	
 	return total_fetal_fraction
 
+def length_counts_per_bin(lengths, max_length, window):
+	'''
+	lengths - pandas dataframe of a length distribution, fragment counts indexed by length.
+	returns a numpy array of the number of fragments in each bin of window lengths up to max_length,
+	the first being [0, window] and the next ones (window, 2 * window], ...
+	'''
+	length_values = lengths.index.values.astype(np.int64)
+	counts = lengths.iloc[:, 0].values.astype(np.float64)
+	in_range = (length_values >= 0) & (length_values <= max_length)
+	# a dense histogram of lengths 0..max_length
+	histogram = np.bincount(length_values[in_range], weights = counts[in_range], minlength = max_length + 1)
+	binned = histogram[1:].reshape(-1, window).sum(axis = 1)
+	binned[0] += histogram[0]
+	return binned
+
 def create_fetal_fraction_per_length_df(shared_lengths, # pandas dataframe of shared fragments length distribution
 					fetal_lengths, # pandas dataframe of fetal fragments length distribution
 					total_fetal_fraction, # the total calculated percent of fetal DNA within the cfDNA
@@ -192,11 +280,6 @@ def create_fetal_fraction_per_length_df(shared_lengths, # pandas dataframe of sh
 	max_len - maximum fragment length used. default: 500.
 
 	'''
-	# TODO: rewrite a simpler version of this function
-
-	# make lists from two length distribution dataframes
-
-
 	## New version - Modification 6/9/2018 - Yazeed
 	# # Change: define variable bins according to availability of values - more than 10 fragments available of both current fetal fraction length and shared fraction length, can define a bin.
 	# # if there is not enough fragments (under 10) add available frangments to the fragments for next length and check if above condition is satisfied. If not, add them to the next and so on.
@@ -255,32 +338,15 @@ def create_fetal_fraction_per_length_df(shared_lengths, # pandas dataframe of sh
 	# 					fetal_fraction_per_length_df[j] = total_fetal_fraction
 
 
-	# Old version of this function
-
-	shared_lengths_list = []
-	for i,c in shared_lengths.iterrows():
-		for j in range(int(c)):
-			shared_lengths_list.append(int(i))
-
-	fetal_lengths_list = []
-	for i,c in fetal_lengths.iterrows():
-		for j in range(int(c)):
-			fetal_lengths_list.append(int(i))
-
-	# define bins (aka categories)
+	# bins of window lengths: [0, window], (window, 2 * window], ..., up to the last multiple of
+	# window under max_len. longer fragments aren't counted
+	window = int(window)
 	bins = range(0, max_len, window)
+	n_bins = len(bins) - 1
 
-	# order the list using the bins - from a continuous variable to a categorical variable
-
-	shared_pd_cut = pd.cut(shared_lengths_list, bins, include_lowest = True)
-	fetal_pd_cut = pd.cut(fetal_lengths_list, bins, include_lowest = True)
-	printverbose('shared_pd_cut')
-	printverbose(shared_pd_cut)
-	printverbose('fetal_pd_cut')
-	printverbose(fetal_pd_cut)
-
-	fetal_binned = pd.value_counts(fetal_pd_cut, sort = False).to_frame().values.tolist()
-	shared_binned = pd.value_counts(shared_pd_cut, sort = False).to_frame().values.tolist()
+	# fragments per bin, summed from the length counts (histograms) without expanding them
+	fetal_binned = length_counts_per_bin(fetal_lengths, bins[-1], window)
+	shared_binned = length_counts_per_bin(shared_lengths, bins[-1], window)
 	printverbose('fetal_binned')
 	printverbose(fetal_binned)
 	printverbose('shared_binned')
@@ -288,39 +354,98 @@ def create_fetal_fraction_per_length_df(shared_lengths, # pandas dataframe of sh
 
 	printerr(total_fetal_fraction)
 
-
 	# for each bin, calculate its fetal fraction
 	# if the fetal fraction is above 1 use (1-err);
 	# if there is not enough fragments (under 5) use the result of the former window
-	fetal_fraction_per_length_df = pd.Series(index = range(0, bins[-1] + 1, 1))
-
-	binned_list_indices = [0] + list(nprepeat(range(len(fetal_binned)), window))
-
-	for i in range(len(fetal_fraction_per_length_df)):
-		idx_in_binned = binned_list_indices[i]
-		fetal = fetal_binned[idx_in_binned][0]
-		shared = shared_binned[idx_in_binned][0]
-		if fetal > 5 or shared > 5: # TODO: or? and?
-			ff = (2 * fetal) / (shared + fetal)
-			if ff > 1:
-				fetal_fraction_per_length_df[i] = 1 - err_rate
-				# if i > 0:
-				# 	fetal_fraction_per_length_df[i] = fetal_fraction_per_length_df[i-1]
-				# else:
-				# 	fetal_fraction_per_length_df[i] = fetal_fraction
-			else:
-				fetal_fraction_per_length_df[i] = ff
-		else:
-			if i > 0:
-				fetal_fraction_per_length_df[i] = fetal_fraction_per_length_df[i-1]
-			else:
-				fetal_fraction_per_length_df[i] = total_fetal_fraction
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		binned_ff = (2 * fetal_binned) / (shared_binned + fetal_binned)
+	binned_ff[binned_ff > 1] = 1 - err_rate
+	binned_ff[~((fetal_binned > 5) | (shared_binned > 5))] = np.nan # TODO: or? and?
 
+	# length 0 is in the first bin, like length 1
+	binned_list_indices = np.concatenate(([0], nprepeat(np.arange(n_bins), window)))
+	import pandas as pd
+	fetal_fraction_per_length_df = pd.Series(binned_ff[binned_list_indices]).ffill().fillna(total_fetal_fraction)
 
 	printverbose(fetal_fraction_per_length_df)
 
 	return fetal_fraction_per_length_df
 
+def preprocessing_fingerprint(db_files, known_dbs = None, **parameters):
+	'''
+	a hash of the databases (their paths, sizes and modification times) and of the parameters
+	of the pre-processing. a fragment store is hashed by the files in its directory. the sizes and
+	modification times of the databases in known_dbs (see is_merged_db) are taken from it.
+	'''
+	files = []
+	for db_file in sorted(db_files):
+		if known_dbs and db_file in known_dbs:
+			files.append([db_file] + known_dbs[db_file][:2])
+			continue
+		paths = [os.path.join(db_file, f) for f in sorted(os.listdir(db_file))] if os.path.isdir(db_file) else [db_file]
+		for path in paths:
+			stat = os.stat(path)
+			files.append([path, stat.st_size, stat.st_mtime_ns])
+	content = json.dumps({'format': PREPROCESSING_FORMAT, 'files': files, 'parameters': parameters}, sort_keys = True)
+	return hashlib.sha256(content.encode()).hexdigest()
+
+def fetal_fractions_lookup(fetal_fractions_df, total_fetal_fraction):
+	'''
+	returns the fetal fraction per length of fetal_fractions_df as an array indexed by length, with an
+	extra last element of total_fetal_fraction. lengths that aren't in fetal_fractions_df have
+	total_fetal_fraction as well, and so do lengths beyond the array, when they are looked up in
+	its last element (as in position.fragments_log_likelihoods). fetal_fractions_df is a pandas
+	series indexed by length, or an array of the fetal fraction of each length (see load_preprocessing).
+	'''
+	fetal_fractions = np.asarray(fetal_fractions_df, dtype = np.float64)
+	if hasattr(fetal_fractions_df, 'index'):
+		lengths = fetal_fractions_df.index.values.astype(np.int64)
+	else:
+		lengths = np.arange(len(fetal_fractions), dtype = np.int64)
+	in_range = lengths >= 0
+	lookup = np.full(max(lengths.max(initial = -1) + 2, 1), total_fetal_fraction, dtype = np.float64)
+	lookup[lengths[in_range]] = fetal_fractions[in_range]
+	return lookup
+
+def save_preprocessing(path, fingerprint, err_rate, total_fetal_fraction, fetal_fractions_df, known_dbs = None):
+	'''
+	writes the results of the pre-processing to a json file. the file is written next to path and
+	then renamed, so that parallel jobs never read a partial file. known_dbs (see is_merged_db) is
+	kept with them, for the jobs that load the file.
+	'''
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+	tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+	with open(tmp_path, 'w') as f:
+		json.dump({	'format': PREPROCESSING_FORMAT,
+				'fingerprint': fingerprint,
+				'err_rate': err_rate,
+				'total_fetal_fraction': total_fetal_fraction,
+				'fetal_fractions': [float(ff) for ff in fetal_fractions_df.values],
+				'databases': known_dbs or {}},
+				f)
+	os.replace(tmp_path, path)
+
+def load_preprocessing(path):
+	'''
+	returns the content of a file of save_preprocessing, or None if there is no such file, or it
+	has another format
+	'''
+	try:
+		with open(path) as f:
+			saved = json.load(f)
+	except (OSError, ValueError):
+		return None
+	if saved.get('format') != PREPROCESSING_FORMAT:
+		return None
+	return saved
+
+def saved_preprocessing_results(saved):
+	'''
+	(err_rate, total_fetal_fraction, fetal_fractions) of the content of a file of save_preprocessing.
+	fetal_fractions is an array of the fetal fraction of each length, so that pandas isn't imported
+	'''
+	return (saved['err_rate'], saved['total_fetal_fraction'], np.array(saved['fetal_fractions'], dtype = np.float64))
+
 def calculate_err_rate():
 	err = 0.003
 	return err
@@ -334,7 +459,29 @@ def run_full_preprocessing(	db_path,
 				max_len = 500,
 				plot = False,
 				qnames = False,
-				region = False):
+				region = False,
+				preprocessing_file = False,
+				gzip_qnames = False):
+	'''
+	preprocessing_file - a json file of the results, shared by hoobari's jobs. if it was saved for the
+	same databases and parameters it's loaded instead of pre-processing again, otherwise it's
+	written. not used with qnames or plot, which need the length distributions. the file also
+	tells which databases of the directory are merged databases, so they aren't all opened to check.
+	'''
+
+	known_dbs = None
+	if preprocessing_file:
+		saved = load_preprocessing(preprocessing_file)
+		known_dbs = dict(saved['databases']) if saved else {}
+		fingerprint = preprocessing_fingerprint(	get_db_files(db_path, region, known_dbs),
+								known_dbs,
+								total_fetal_fraction = total_fetal_fraction,
+								use_prior_ff_dist = bool(use_prior_ff_dist),
+								window = int(window),
+								max_len = max_len)
+		if not (qnames or plot) and saved and saved['fingerprint'] == fingerprint:
+			printerr('pre-processing', 'loaded from', preprocessing_file)
+			return saved_preprocessing_results(saved)
 
 	printerr('pre-processing', 'calculating error rate (a place holder is temporarily set to 0.003)')
 	err_rate = calculate_err_rate()
@@ -344,7 +491,7 @@ def run_full_preprocessing(	db_path,
 
 	if calculate_empirical_ff_dist or calculate_fetal_fraction:
 		printerr('pre-processing', 'creating length distributions')
-		shared_lengths, fetal_lengths = create_length_distributions(db_path, cores, qnames, region)
+		shared_lengths, fetal_lengths = create_length_distributions(db_path, cores, qnames, region, gzip_qnames, known_dbs)
 		if plot:
 			printerr('pre-processing', 'saving length distributions plot as', fetal_sample + '.length_distributions.png')
 			generate_length_distributions_plot(shared_lengths, fetal_lengths, fetal_sample)
@@ -366,6 +513,7 @@ def run_full_preprocessing(	db_path,
 		printerr('using prior knowledge to estimate the ratios of the length-distributions')
 		fetal_fractions_df = estimate_length_distribution(total_fetal_fraction)
 
-		
+	if preprocessing_file:
+		save_preprocessing(preprocessing_file, fingerprint, err_rate, total_fetal_fraction, fetal_fractions_df, known_dbs)
 
 	return (err_rate, total_fetal_fraction, fetal_fractions_df)
@@ -0,0 +1,69 @@
+'''
+Template lengths (TLEN) of the cfDNA reads around the positions assessed by freebayes_patch.py.
+'''
+
+import math
+import heapq
+
+class TemplateLengthCache(object):
+	'''
+	Streaming, position-ordered replacement for a +-flank bp bam fetch per position.
+	The window [position - flank, position + flank) is only extended forward, so each bam
+	record is decoded about once per region, and reads which fell behind the window are dropped,
+	so memory is bounded by the window size.
+	Positions must be visited in increasing order within a contig; moving backwards or to
+	another contig restarts the window.
+	'''
+
+	def __init__(self, bam_reader, flank = 1000):
+		self.bam_reader = bam_reader
+		self.flank = flank
+		self.reset()
+
+	def reset(self, chrom = None):
+		self.chrom = chrom
+		self.window_start = 0
+		self.fetched_until = 0
+		self.tlen_dic = {} # qname -> abs(TLEN)
+		self.read_ends = {} # qname -> rightmost reference end of its records
+		self.ends_heap = [] # (reference end, qname)
+
+	def get(self, chrom, position):
+		'''
+		returns a qname -> abs(TLEN) dictionary of the reads overlapping
+		[position - flank, position + flank). The dictionary is updated in place by the next call.
+		'''
+		position = int(position)
+		start_pos = max(0, position - self.flank)
+		end_pos = min(self.bam_reader.get_reference_length(chrom), position + self.flank)
+
+		if chrom != self.chrom or start_pos < self.window_start:
+			self.reset(chrom)
+
+		# drop reads that ended before the window
+		while self.ends_heap and self.ends_heap[0][0] <= start_pos:
+			read_end, qname = heapq.heappop(self.ends_heap)
+			if self.read_ends.get(qname) == read_end:
+				del self.read_ends[qname]
+				del self.tlen_dic[qname]
+		self.window_start = start_pos
+
+		# extend the window forward
+		fetch_start = max(start_pos, self.fetched_until)
+		if end_pos > fetch_start:
+			for rec in self.bam_reader.fetch(chrom, fetch_start, end_pos):
+				# records which start before fetch_start overlap the previous window, so they are cached already
+				if rec.reference_start < self.fetched_until:
+					continue
+				self._add(rec)
+			self.fetched_until = end_pos
+
+		return self.tlen_dic
+
+	def _add(self, rec):
+		qname = rec.query_name
+		read_end = rec.reference_end or rec.reference_start + 1 # unmapped mates have no reference end
+		self.tlen_dic[qname] = math.fabs(int(rec.template_length))
+		if read_end > self.read_ends.get(qname, -1):
+			self.read_ends[qname] = read_end
+			heapq.heappush(self.ends_heap, (read_end, qname))
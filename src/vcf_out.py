@@ -28,7 +28,9 @@ def printvcf(x, *args, out_path = False, **kargs):
 
 def make_header(cfdna_vcf_reader, parents_vcf_reader, input_command, fetal_sample_name, reserved_formats, output_path = False):
 	
-	if cfdna_vcf_reader.metadata['reference'] != parents_vcf_reader.metadata['reference']:
+	# the vcf of pileup_ingest.py has no reference
+	reference = cfdna_vcf_reader.metadata.get('reference', parents_vcf_reader.metadata.get('reference'))
+	if reference != parents_vcf_reader.metadata.get('reference', reference):
 		printerr('Warning! are the vcf files based on the same reference genome?')
 	if cfdna_vcf_reader.contigs != parents_vcf_reader.contigs:
 		printerr('Warning! cfdna and parental vcf files have different contigs')
@@ -38,7 +40,7 @@ def make_header(cfdna_vcf_reader, parents_vcf_reader, input_command, fetal_sampl
 			'##fileDate=' + strftime('%Y%m%d'),
 			'##source=hoobari',
 			'##phasing=none', # phasing is not yet supported
-			'##reference=' + cfdna_vcf_reader.metadata['reference'],
+			*(['##reference=' + reference] if reference else []),
 			'##commandline="' + input_command + '"',
 			sep = '\n',
 			out_path = output_path)